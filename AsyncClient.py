@@ -0,0 +1,199 @@
+import asyncio
+import random
+import threading
+
+from Client import (ClientBase, LinkLost, make_payload, ADDR, COMPRESSION,
+                    SEND_INTERVAL, SERVER_TIMEOUT, RECONNECT_DELAY, MAX_RECONNECT_DELAY,
+                    ACK_TIMEOUT, DISCONNECT_MSG, HEARTBEAT_MSG, HELLO_MSG)
+from MessageStream import AsyncMessageStream, FrameError
+from WireFormat import WireError
+
+# Client on asyncio. Every AsyncClient of a process shares one event loop
+# running on one background thread (ClientLoop), where each pond's reader
+# and periodic sender are tasks and its MIGRATEs and !DISCONNECT are
+# coroutines, so a process can host many ponds without a thread per pond
+# or per message:
+#
+#   c = AsyncClient(pond).start()
+#
+# Methods without "async" in their name are for other threads (the
+# simulation, the pygame loop) and hand their work to the loop; the
+# *_async coroutines only run on the loop itself. Blocking ones
+# (sync_pond, disconnect) must not be called from the loop thread.
+
+
+class ClientLoop:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name="client-loop", daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine):
+        # Any thread: runs coroutine on the loop; returns a concurrent Future
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        # Any thread
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback, *args)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+shared = None
+sharedLock = threading.Lock()
+
+
+def shared_loop():
+    # The process-wide ClientLoop, started on first use
+    global shared
+    with sharedLock:
+        if shared is None:
+            shared = ClientLoop()
+        return shared
+
+
+class AsyncClient(ClientBase):
+    def __init__(self, pond, addr=ADDR, loop=None, shards=None):
+        super().__init__(pond, addr, shards)
+        self.loop = loop if loop is not None else shared_loop()
+        self.stream = None
+        self.sync_lock = asyncio.Lock()
+        self.tasks = []
+        self.finished = None
+
+    def start(self):
+        # Returns once the first attempt to connect is over, like Client();
+        # if it failed the client keeps retrying in the background
+        attempted = threading.Event()
+        self.finished = self.loop.submit(self.run(attempted))
+        attempted.wait()
+        return self
+
+    def sync_pond(self, keyframe=False):
+        return self.loop.submit(self.sync_pond_async(keyframe)).result()
+
+    def migrate_fishes(self, fishes, destination):
+        # Any thread; the Future resolves like ClientBase.migrate_fishes'
+        return self.loop.submit(self.migrate_async(fishes, destination))
+
+    def subscribe(self, interests):
+        return self.loop.submit(self.subscribe_async(interests))
+
+    def disconnect(self, timeout=ACK_TIMEOUT):
+        return self.loop.submit(self.disconnect_async(timeout)).result()
+
+    async def run(self, attempted):
+        # The pond's life on the loop: connect, then read until we leave
+        connected = await self.connect_async()
+        attempted.set()
+        self.tasks.append(asyncio.ensure_future(self.send_loop()))
+        if connected or await self.reconnect_async():
+            await self.read_loop()
+        self.connected = False
+
+    async def connect_async(self):
+        try:
+            reader, writer = await asyncio.open_connection(*self.addr)
+        except OSError:
+            print("Can not connect to the server")
+            return False
+        self.stream = AsyncMessageStream(reader, writer)
+        if COMPRESSION:
+            self.stream.send(make_payload(HELLO_MSG, COMPRESSION))
+        self.connected = True
+        print(f"Client connected ")
+        return True
+
+    async def reconnect_async(self):
+        # False only if the client is shutting down
+        self.connected = False
+        if self.stream is not None:
+            self.stream.close()
+        delay = RECONNECT_DELAY
+        while not self.closing:
+            if await self.connect_async():
+                # Whoever was watching us lost our state with the old link
+                self.resubscribe()
+                await self.sync_pond_async(keyframe=True)
+                self.reconnects += 1
+                return True
+            await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        return False
+
+    async def read_loop(self):
+        # The only reader of the connection; like Client.get_msg it keeps
+        # going after disconnect() until the hub closes the link
+        while True:
+            try:
+                msg = await asyncio.wait_for(self.stream.recv(), SERVER_TIMEOUT)
+            except WireError as e:
+                # The frame was consumed, so the stream is still in step
+                print(e)
+                continue
+            except (OSError, FrameError, asyncio.TimeoutError) as e:
+                print(e)
+                msg = None
+            if msg is None:
+                print("Connection to the vivisystem closed")
+                self.fail_requests(LinkLost("Connection to the vivisystem lost"))
+                if self.closing or not await self.reconnect_async():
+                    break
+                continue
+            self.messageQ.append(msg)
+            self.handle_msg(msg)
+
+    async def send_loop(self):
+        while not self.closing:
+            await asyncio.sleep(SEND_INTERVAL)
+            self.expire_requests()
+            if not self.connected:
+                continue
+            stream = self.stream
+            try:
+                await self.sync_pond_async()
+                stream.send(make_payload(HEARTBEAT_MSG, self.pond))
+                await stream.drain()
+            except OSError as e:
+                # The reader notices too and reconnects
+                print(e)
+
+    async def sync_pond_async(self, keyframe=False):
+        async with self.sync_lock:
+            if not self.connected:
+                return False
+            frame = await self.state.latest_async()
+            return self.send_state(frame, keyframe)
+
+    async def migrate_async(self, fishes, destination):
+        if not self.connected:
+            raise ConnectionError("Not connected to the vivisystem")
+        return await asyncio.wrap_future(
+            ClientBase.migrate_fishes(self, fishes, destination))
+
+    async def subscribe_async(self, interests):
+        if not self.connected:
+            # Sent as soon as we are
+            self.interests = dict(interests)
+            raise ConnectionError("Not connected to the vivisystem")
+        return await asyncio.wrap_future(ClientBase.subscribe(self, interests))
+
+    async def disconnect_async(self, timeout=ACK_TIMEOUT):
+        # True once the hub has confirmed we are gone
+        print("Disconnecting...")
+        self.closing = True
+        if not self.connected:
+            return False
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(
+                self.request(DISCONNECT_MSG, self.pond, timeout)), timeout)
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            print(e)
+            return False
@@ -3,13 +3,21 @@ import threading
 import sys
 import time
 import random
+import itertools
 from queue import Queue
+from collections import deque
+from concurrent.futures import Future, TimeoutError as RequestTimeout
 
 # sys.path.append('../src')
 from FishData import FishData
 from PondData import PondData
+from PondState import PondState
+from PondDelta import takeSnapshot, diffPond
 from Payload import Payload
-import pickle
+from MessageStream import MessageStream, FrameError
+import Compression
+from WireFormat import WireError
+from ShardRing import shard_address
 
 
 # IP = '0.tcp.ap.ngrok.io'
@@ -19,88 +27,179 @@ ADDR = (IP, PORT)
 MSG_SIZE = 4096
 FORMAT = "utf-8"
 DISCONNECT_MSG = "!DISCONNECT"
+BOUNCE_MSG = "BOUNCE"
+HEARTBEAT_MSG = "HEARTBEAT"
+HELLO_MSG = "HELLO"
+ACK_MSG = "ACK"
+SUBSCRIBE_MSG = "SUBSCRIBE"
+SUMMARY_MSG = "SUMMARY"
+# Codecs we offer the hub, most preferred first; [] turns compression off
+COMPRESSION = Compression.PREFERENCE
+SEND_INTERVAL = 2
+# We send a heartbeat every SEND_INTERVAL whatever else we send, and the hub
+# echoes it; this much silence means the link is dead. Pond state is no
+# substitute: a pond that subscribed at COUNT detail hears nothing back
+# about itself.
+SERVER_TIMEOUT = 3 * SEND_INTERVAL
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30
+MESSAGE_HISTORY = 100
+# Every KEYFRAME_INTERVAL-th send is a full SEND snapshot, the rest are DELTAs
+KEYFRAME_INTERVAL = 10
+# A MIGRATE or !DISCONNECT the hub has not answered in this long has failed
+ACK_TIMEOUT = 5
 
 
-class Client:
-    def __init__(self, pond):
-        self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server = IP
-        self.port = PORT
-        self.addr = ADDR
-        self.connected = True
+class LinkLost(ConnectionError):
+    # The connection went down while a request was in flight: unlike a
+    # request that could not be sent, it may have arrived
+    pass
+
+
+def make_payload(action, data=None):
+    payload = Payload()
+    payload.action = action
+    payload.data = data
+    return payload
+
+
+class ClientBase:
+    # What a pond's link to the hub does regardless of how it does I/O:
+    # sending the pond's state, requests and their answers, handling what
+    # the hub sends. Client runs it on blocking sockets and threads,
+    # AsyncClient.AsyncClient on an asyncio event loop.
+
+    def __init__(self, pond, addr=ADDR, shards=None):
+        # With shards, addr is a hub sharded by port (shardserver.py) and the
+        # pond connects to the shard that owns its name
+        if shards:
+            addr = shard_address(pond.pondName, addr, shards)
+        self.server, self.port = addr
+        self.addr = addr
+        self.connected = False
+        self.closing = False
         self.other_ponds = {}
-        self.msg = self.connect()
-        self.payload = Payload()
         self.pond = pond
-        self.messageQ = []
+        # Network threads only reach the pond through this
+        self.state = PondState(pond)
+        self.messageQ = deque(maxlen=MESSAGE_HISTORY)
         self.disconnected_ponds = {}
+        self.sent_snapshot = None
+        self.sends_since_keyframe = 0
+        # Sync version of what we last sent. Kept here, not on the pond: the
+        # live PondData belongs to the simulation and the published snapshot
+        # must not change.
+        self.sent_version = 0
+        # Times the link was lost and opened again
+        self.reconnects = 0
+        # Requests waiting for their ACK/BOUNCE: correlation id -> (Future, deadline)
+        self.requests = {}
+        self.request_ids = itertools.count(1)
+        # pond name -> "COUNT" or "FULL" once we subscribe; None gets us
+        # every pond in full
+        self.interests = None
 
-    def get_msg(self):
-        while True:
-            # time.sleep(0.5)
-            msg = pickle.loads(self.client.recv(MSG_SIZE))
-            if(msg):
-                self.messageQ.append(msg)
-                self.handle_msg(msg)
+    def send_state(self, frame, keyframe):
+        # Sends frame, a snapshot of our pond, as a SEND keyframe or as a
+        # DELTA against the last one. TCP keeps our messages in order, so
+        # every receiver that saw the previous version can apply the next
+        # delta on top of it. Ponds that joined late ignore deltas until the
+        # next keyframe.
+        if frame is None:
+            return False
+        if (keyframe or self.sent_snapshot is None
+                or self.sends_since_keyframe >= KEYFRAME_INTERVAL):
+            fishes = frame.fishes
+            self.sent_version += 1
+            message = PondData(frame.pondName)
+            message.fishes = fishes
+            message.version = self.sent_version
+            self.sent_snapshot = takeSnapshot(fishes)
+            self.sends_since_keyframe = 0
+            self.stream.send(make_payload("SEND", message))
+            return True
 
-    def connect(self):
-        try:
-            self.client.connect(self.addr)
-            print(f"Client connected ")
-            return "Connected"
-        except:
-            print("Can not connect to the server")
+        self.sends_since_keyframe += 1
+        delta = diffPond(frame, self.sent_snapshot, self.sent_version)
+        if delta.isEmpty():
+            return False
+        self.sent_version = delta.version
+        self.stream.send(make_payload("DELTA", delta))
+        return True
 
-    def send_pond(self):
-        try:
-            while True:
-                time.sleep(2)
-                self.payload.action = "SEND"
-                self.payload.data = self.pond
-                #print("Client send :",self.pond)
-                self.client.send(pickle.dumps(self.payload))
-                #msg =  pickle.loads(self.client.recv(MSG_SIZE))
-                # return self.handle_msg(msg)
+    def heartbeat(self):
+        self.stream.send(make_payload(HEARTBEAT_MSG, self.pond))
 
+    def request(self, action, data, timeout=ACK_TIMEOUT):
+        # Sends without waiting; the Future resolves when the reader gets the
+        # answer (see answer()), or fails on timeout (RequestTimeout) or a
+        # lost connection (LinkLost). It fails with socket.error right away
+        # if it could not be sent at all. Any number of requests can be in
+        # flight on the one connection.
+        payload = make_payload(action, data)
+        payload.id = next(self.request_ids)
+        future = Future()
+        self.requests[payload.id] = (future, time.monotonic() + timeout)
+        try:
+            self.stream.send(payload)
         except socket.error as e:
-            print(e)
+            self.requests.pop(payload.id, None)
+            future.set_exception(e)
+        return future
 
-    def migrate_fish(self, fishData, destination):
-        # Migration takes a special object for the payload to pickup : The destination pond's name
-        try:
+    def answer(self, msg, result):
+        entry = self.requests.pop(msg.id, None)
+        if entry is not None:
+            entry[0].set_result(result)
 
-            migration = {
-                "destination": destination,
-                "fish": fishData
-            }
-            self.payload.action = "MIGRATE"
-            self.payload.data = migration
-
-            self.client.send(pickle.dumps(self.payload))
-            print("=======MIGRATED=======")
-            # Handle our fish in the pond
-            # // TO BE IMPLEMENTED
-
-            msg = pickle.loads(self.client.recv(MSG_SIZE))
-            return self.handle_msg(msg)
-
-            # print("Client send :",pond)
-            # next_pond = random.random_choice(self.other_ponds.keys())
-            # self.client.send("MIGRATE FROM sick_salmon TO "+ next_pond + " " + pickle.dumps(fishData))
-            # msg =  pickle.loads(self.client.recv(MSG_SIZE))
-            # return self.handle_msg(msg)
-        except socket.error as e:
-            print(e)
+    def expire_requests(self):
+        now = time.monotonic()
+        for requestId, (future, deadline) in list(self.requests.items()):
+            if deadline <= now and self.requests.pop(requestId, None) is not None:
+                future.set_exception(RequestTimeout(f"No answer to request {requestId}"))
 
-    def disconnect(self):
-        try:
-            self.payload.action = DISCONNECT_MSG
-            print("Disconnecting...")
-            self.client.send(pickle.dumps(self.payload))
-            return self.client.recv(MSG_SIZE)
+    def fail_requests(self, error):
+        for requestId in list(self.requests):
+            entry = self.requests.pop(requestId, None)
+            if entry is not None:
+                entry[0].set_exception(error)
 
-        except socket.error as e:
-            print(e)
+    def subscribe(self, interests):
+        # From now on the hub only sends us the ponds in interests, and for
+        # the COUNT ones a SUMMARY of how many fish they have instead of the
+        # fish. Kept so that a reconnect can repeat it (resubscribe()).
+        self.interests = dict(interests)
+        for pondName in list(self.other_ponds):
+            if pondName not in self.interests:
+                self.other_ponds.pop(pondName, None)
+        return self.request(SUBSCRIBE_MSG, self.interests)
+
+    def resubscribe(self):
+        if self.interests is not None:
+            self.request(SUBSCRIBE_MSG, self.interests)
+
+    def migrate_fish(self, fishData, destination):
+        return self.migrate_fishes([fishData], destination)
+
+    def migrate_fishes(self, fishes, destination):
+        # One MIGRATE carries every fish bound for destination. The Future
+        # resolves to "delivered" once the destination pond has the fish, or
+        # "bounced" (the fish are back home).
+        migration = {
+            "destination": destination,
+            "fishes": fishes
+        }
+        future = self.request("MIGRATE", migration)
+        if future.done() and future.exception() is not None:
+            print(future.exception())
+        else:
+            print("=======MIGRATED=======", len(fishes), "to", destination)
+        return future
+
+    def welcome(self, fishes):
+        for fishData in fishes:
+            fishData.state = "in-pond"
+            self.state.deliver(fishData)
 
     def handle_msg(self, msg):
         msg_action = msg.action
@@ -113,18 +212,53 @@ class Client:
             print(self.other_ponds)
             return msg
 
+        elif(msg_action == "DELTA"):
+            pond = self.other_ponds.get(msg_object.pondName)
+            if isinstance(pond, PondData):
+                # Out of step with this pond: wait for its next keyframe
+                msg_object.apply(pond)
+            return msg
+
+        elif(msg_action == SUMMARY_MSG):
+            # A pond we only count
+            self.other_ponds[msg_object.pondName] = msg_object
+            return msg
+
         elif(msg_action == "MIGRATE"):
+            # The server only sends us migrations addressed to this pond
             if(self.pond.pondName == msg_object["destination"]):
                 print("=======RECIEVED MIGRATION=======")
-                self.pond.addFish(msg_object["fish"])
-                print(self.pond.fishes)
+                self.welcome(msg_object["fishes"])
                 print("================================")
+                if msg.id:
+                    # Through the hub, this tells the sender they arrived
+                    ack = make_payload(ACK_MSG)
+                    ack.id = msg.id
+                    try:
+                        self.stream.send(ack)
+                    except socket.error as e:
+                        print(e)
+
+        elif(msg_action == BOUNCE_MSG):
+            # Nobody is called msg_object["destination"], the fish swims back
+            print("=======MIGRATION BOUNCED=======", msg_object["destination"])
+            self.welcome(msg_object["fishes"])
+            self.answer(msg, "bounced")
+
+        elif(msg_action == ACK_MSG):
+            self.answer(msg, "delivered")
+
+        elif(msg_action == HELLO_MSG):
+            # The hub compresses big frames to us with this codec from now on,
+            # and so do we
+            self.stream.codec = Compression.codec_id(msg_object[0]) if msg_object else Compression.NONE
 
         elif(msg_action == DISCONNECT_MSG):
             print("DIS ACTION", msg_action)
             print("DIS OBJECT", msg_object)
             #self.disconnected_ponds[msg_object.pondName] = msg_object
-            self.other_ponds.pop(msg_object.pondName)
+            if msg_object is not None:
+                self.other_ponds.pop(msg_object.pondName, None)
 
         else:
             pass
@@ -139,6 +273,113 @@ class Client:
         #     return msg
 
 
+class Client(ClientBase):
+    def __init__(self, pond, addr=ADDR, shards=None):
+        super().__init__(pond, addr, shards)
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.stream = MessageStream(self.client)
+        self.connected = True
+        self.reconnect_lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.msg = self.connect()
+
+    def get_msg(self):
+        # The only reader of the socket. It keeps reading after disconnect()
+        # until the hub closes the link, so the goodbye's ACK still arrives.
+        while True:
+            # time.sleep(0.5)
+            stream = self.stream
+            try:
+                msg = stream.recv()
+            except WireError as e:
+                # The frame was consumed, so the stream is still in step
+                print(e)
+                continue
+            except (socket.error, FrameError) as e:
+                print(e)
+                msg = None
+            if msg is None:
+                print("Connection to the vivisystem closed")
+                # Answers to anything sent on that link are not coming
+                self.fail_requests(LinkLost("Connection to the vivisystem lost"))
+                if self.closing or not self.reconnect(stream):
+                    break
+                continue
+            self.messageQ.append(msg)
+            self.handle_msg(msg)
+        self.connected = False
+
+    def connect(self):
+        try:
+            self.client.connect(self.addr)
+            self.client.settimeout(SERVER_TIMEOUT)
+            if COMPRESSION:
+                self.stream.send(make_payload(HELLO_MSG, COMPRESSION))
+            print(f"Client connected ")
+            return "Connected"
+        except:
+            print("Can not connect to the server")
+
+    def reconnect(self, stream):
+        # Called by whichever thread notices that stream is dead. Returns
+        # False only if the client is shutting down.
+        with self.reconnect_lock:
+            if self.stream is not stream:
+                return True  # another thread already reconnected
+            stream.close()
+            delay = RECONNECT_DELAY
+            while not self.closing:
+                self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.stream = MessageStream(self.client)
+                if self.connect():
+                    try:
+                        # Whoever was watching us lost our state with the old link
+                        self.resubscribe()
+                        self.sync_pond(keyframe=True)
+                        self.reconnects += 1
+                        return True
+                    except socket.error as e:
+                        print(e)
+                        self.stream.close()
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            return False
+
+    def send_pond(self):
+        while not self.closing:
+            time.sleep(SEND_INTERVAL)
+            self.expire_requests()
+            stream = self.stream
+            try:
+                #print("Client send :",self.pond)
+                self.sync_pond()
+                stream.send(make_payload(HEARTBEAT_MSG, self.pond))
+                #msg =  pickle.loads(self.client.recv(MSG_SIZE))
+                # return self.handle_msg(msg)
+            except socket.error as e:
+                print(e)
+                if self.closing or not self.reconnect(stream):
+                    break
+
+    def sync_pond(self, keyframe=False):
+        with self.sync_lock:
+            return self.sync_pond_locked(keyframe)
+
+    def sync_pond_locked(self, keyframe):
+        return self.send_state(self.state.latest(), keyframe)
+
+    def disconnect(self, timeout=ACK_TIMEOUT):
+        # True once the hub has confirmed we are gone
+        print("Disconnecting...")
+        self.closing = True
+        try:
+            self.request(DISCONNECT_MSG, self.pond, timeout).result(timeout)
+            return True
+        except (socket.error, RequestTimeout) as e:
+            print(e)
+            return False
+
+
 # if __name__ == "__main__":
 
 #     f1 = FishData("Sick Salmon", "123456")
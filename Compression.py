@@ -0,0 +1,98 @@
+import zlib
+
+# Per-frame compression codecs. The codec id goes in the flags byte of the
+# frame header (0 = not compressed), so a receiver can always decode a frame
+# without knowing what was negotiated. zlib is always there; lz4 and zstd are
+# used when their packages are installed.
+#
+# Small frames (heartbeats, single migrations, most deltas) are not worth the
+# CPU, so only frames of at least COMPRESS_THRESHOLD bytes are compressed, and
+# only when that actually makes them smaller.
+COMPRESS_THRESHOLD = 1024
+ZLIB_LEVEL = 1
+MAX_OUTPUT = 64 * 1024 * 1024
+
+NONE = 0
+
+
+class CompressionError(Exception):
+    pass
+
+
+def zlib_decompress(data):
+    decompressor = zlib.decompressobj()
+    out = decompressor.decompress(data, MAX_OUTPUT)
+    if decompressor.unconsumed_tail:
+        raise CompressionError("Compressed frame expands past the size limit")
+    return out
+
+
+# name -> (id, compress, decompress)
+CODECS = {
+    "zlib": (1, lambda data: zlib.compress(data, ZLIB_LEVEL), zlib_decompress),
+}
+
+try:
+    import lz4.frame
+
+    def lz4_decompress(data):
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        out = decompressor.decompress(data, max_length=MAX_OUTPUT)
+        if not decompressor.eof:
+            raise CompressionError("Compressed frame is truncated or expands past the size limit")
+        return out
+
+    CODECS["lz4"] = (2, lz4.frame.compress, lz4_decompress)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    _zstd_compressor = zstandard.ZstdCompressor(level=1)
+    _zstd_decompressor = zstandard.ZstdDecompressor()
+    CODECS["zstd"] = (
+        3, _zstd_compressor.compress,
+        lambda data: _zstd_decompressor.decompress(data, max_output_size=MAX_OUTPUT))
+except ImportError:
+    pass
+
+# Fastest first
+PREFERENCE = [name for name in ("lz4", "zstd", "zlib") if name in CODECS]
+BY_ID = {codec[0]: codec for codec in CODECS.values()}
+
+
+def codec_id(name):
+    codec = CODECS.get(name)
+    return codec[0] if codec is not None else NONE
+
+
+def choose(offered):
+    # The first codec in the peer's preference list that we also have
+    for name in offered:
+        if name in CODECS:
+            return name
+    return None
+
+
+def compress(data, codec):
+    # Returns (flags, body) for one frame
+    if codec == NONE or len(data) < COMPRESS_THRESHOLD:
+        return NONE, data
+    packed = BY_ID[codec][1](data)
+    if len(packed) >= len(data):
+        return NONE, data
+    return codec, packed
+
+
+def decompress(flags, body):
+    if flags == NONE:
+        return body
+    codec = BY_ID.get(flags)
+    if codec is None:
+        raise CompressionError(f"Frame compressed with unknown codec {flags}")
+    try:
+        return codec[2](body)
+    except CompressionError:
+        raise
+    except Exception as e:
+        raise CompressionError(f"Could not decompress frame: {e}")
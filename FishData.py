@@ -1,36 +1,128 @@
+import itertools
+import os
 import random
-import math
-
-
-def randId():
-    digits = [i for i in range(0, 10)]
-    random_str = ""
-    for i in range(6):
-        index = math.floor(random.random() * 10)
-        random_str += str(digits[index])
-    return random_str
-
-
-def randCrowdThresh():
-    return random.randint(5, 20)
-
-
-def randPheromoneThresh():
-    return random.randint(30, 60)
+import sys
+import threading
+import zlib
+
+# Fish ids are 64-bit numbers written as decimal strings:
+#
+#   24 bits  tag of the pond the fish was born in (crc32 of its name)
+#   16 bits  random nonce picked when this process first makes a fish there
+#   24 bits  counter
+#
+# so ids from different ponds never collide, and neither do ids from two runs
+# of the same pond unless both draw the same nonce (1 in 65536). When the
+# counter runs out the allocator moves on to a fresh nonce.
+#
+# The simulations give their offspring ids from the allocator of their own
+# pond (whatever the parent's genesis), and a seeded simulation uses a private
+# IdAllocator with a seeded rng so that the ids are the same on every run.
+TAG_BITS = 24
+NONCE_BITS = 16
+COUNTER_BITS = 24
+
+
+def pondTag(pondName):
+    return zlib.crc32(pondName.encode("utf-8")) & ((1 << TAG_BITS) - 1)
+
+
+class IdAllocator:
+    def __init__(self, pondName, rng=None):
+        self.tag = pondTag(pondName)
+        self.rng = rng
+        self.lock = threading.Lock()
+        self.used = set()
+        self.newBlock()
+
+    def newBlock(self):
+        if self.rng is None:
+            nonce = int.from_bytes(os.urandom(2), "big")
+        else:
+            nonce = self.rng.getrandbits(NONCE_BITS)
+        while nonce in self.used:
+            nonce = (nonce + 1) & ((1 << NONCE_BITS) - 1)
+        self.used.add(nonce)
+        base = ((self.tag << NONCE_BITS) | nonce) << COUNTER_BITS
+        # next() on an itertools.count is atomic, so threads need no lock
+        # until a block runs out
+        self.block = (base, itertools.count())
+
+    def next(self):
+        block = self.block
+        n = next(block[1])
+        if n >> COUNTER_BITS:
+            with self.lock:
+                if self.block is block:
+                    self.newBlock()
+            return self.next()
+        return str(block[0] | n)
+
+
+allocators = {}
+allocatorsLock = threading.Lock()
+
+
+def allocatorFor(pondName):
+    # The process-wide allocator for fish born in pondName
+    allocator = allocators.get(pondName)
+    if allocator is None:
+        with allocatorsLock:
+            allocator = allocators.get(pondName)
+            if allocator is None:
+                allocator = allocators[pondName] = IdAllocator(pondName)
+    return allocator
+
+
+def newId(pondName):
+    return allocatorFor(pondName).next()
+
+
+# rng is anything with a random() method (random.Random, numpy Generator);
+# the simulations pass their own so that a seeded run stays reproducible
+def randCrowdThresh(rng=random):
+    return 5 + int(rng.random() * 16)        # 5..20
+
+
+def randPheromoneThresh(rng=random):
+    return 30 + int(rng.random() * 31)       # 30..60
 
 
 class FishData:
-    def __init__(self, genesis, parentId=None):
-        self.id = randId()
+    __slots__ = ("id", "state", "status", "genesis", "crowdThreshold",
+                 "pheromone", "pheromoneThresh", "lifetime", "parentId")
+
+    def __init__(self, genesis, parentId=None, rng=random, ids=None):
+        genesis = sys.intern(genesis)
+        self.id = newId(genesis) if ids is None else ids.next()
         self.state = "in-pond"
         self.status = "alive"
         self.genesis = genesis  # Pond name
-        self.crowdThreshold = randCrowdThresh()
+        self.crowdThreshold = randCrowdThresh(rng)
         self.pheromone = 0
-        self.pheromoneThresh = randPheromoneThresh()
+        self.pheromoneThresh = randPheromoneThresh(rng)
         self.lifetime = 60
         self.parentId = parentId
 
+    def syncState(self):
+        # Fields other ponds care about. pheromone ticks up every frame and is
+        # only used locally, so it does not make a fish count as changed.
+        return (self.state, self.status, self.genesis, self.crowdThreshold,
+                self.pheromoneThresh, self.lifetime, self.parentId)
+
+    def copy(self):
+        fish = FishData.__new__(FishData)
+        fish.id = self.id
+        fish.state = self.state
+        fish.status = self.status
+        fish.genesis = self.genesis
+        fish.crowdThreshold = self.crowdThreshold
+        fish.pheromone = self.pheromone
+        fish.pheromoneThresh = self.pheromoneThresh
+        fish.lifetime = self.lifetime
+        fish.parentId = self.parentId
+        return fish
+
     def getId(self):
         return self.id
 
@@ -45,15 +137,3 @@ class FishData:
 
     def getcrowdThreshold(self):
         return self.crowdThreshold
-
-    def pheromone(self):
-        return self.pheromone
-
-    def pheromoneThresh(self):
-        return self.pheromoneThresh
-
-    def lifetime(self):
-        return self.lifetime
-
-    def parentId(self):
-        return self.parentId
@@ -0,0 +1,351 @@
+import hashlib
+
+import numpy as np
+
+from SpatialGrid import ArrayGrid
+from FishData import FishData, allocatorFor
+from Simulation import (SPEED_FISH, MAX_FISH, MAX_SIZE, START_SIZE, POND_WIDTH, POND_HEIGHT,
+                        MIGRATION_TARGETS, MIGRATION_CHANCE, CROWD_RADIUS)
+
+# Vectorized version of Simulation.PondSimulation for big ponds. Every fish
+# is a slot in a set of parallel NumPy arrays (struct of arrays) and a tick
+# is a handful of whole-array operations, so the per-tick Python work only
+# grows with the number of fish that arrive, die or migrate, not with the
+# size of the pond.
+#
+# The rules are the same as FishBody/PondSimulation.step_fish; step() has the
+# same (born, gone) result, with FishHandle standing in for FishBody. The one
+# difference is crowding: rather than counting the fish within CROWD_RADIUS of
+# each fish, the engine counts the fish in the 3x3 block of CROWD_RADIUS-sized
+# grid cells around it, which costs one bincount per tick for the whole pond.
+
+INITIAL_CAPACITY = 1024
+
+
+class FishHandle:
+    # Read-only FishBody look-alike for one fish in a FishEngine
+    __slots__ = ("engine", "fishData")
+
+    def __init__(self, engine, fishData):
+        self.engine = engine
+        self.fishData = fishData
+
+    def slot(self):
+        return self.engine.index[self.fishData.id]
+
+    @property
+    def x(self):
+        return int(self.engine.x[self.slot()])
+
+    @property
+    def y(self):
+        return int(self.engine.y[self.slot()])
+
+    def position(self, alpha=1.0):
+        # Where the fish is alpha of the way from the previous tick to this one
+        engine = self.engine
+        slot = self.slot()
+        x0 = engine.prev_x[slot]
+        y0 = engine.prev_y[slot]
+        return (int(x0 + (engine.x[slot] - x0) * alpha),
+                int(y0 + (engine.y[slot] - y0) * alpha))
+
+    @property
+    def size(self):
+        return float(self.engine.size[self.slot()])
+
+    @property
+    def age(self):
+        return int(self.engine.age[self.slot()])
+
+    # A fish's animation frame advances once per tick, like its age
+    frame = age
+
+    @property
+    def lifetime(self):
+        return int(self.engine.lifetime[self.slot()])
+
+    @property
+    def face_right(self):
+        return bool(self.engine.face_right[self.slot()])
+
+
+class FishEngine:
+    def __init__(self, pond, on_migrate=None, rng=None,
+                 width=POND_WIDTH, height=POND_HEIGHT, capacity=INITIAL_CAPACITY,
+                 max_fish=MAX_FISH, recorder=None, ids=None, state=None):
+        self.pond = pond
+        # PondState shared with the network threads, if any
+        self.state = state
+        if state is not None:
+            state.attach()
+        # IdAllocator for offspring
+        self.ids = ids if ids is not None else allocatorFor(pond.pondName)
+        self.max_fish = max_fish
+        # SessionLog.Recorder that logs what the network put in the pond
+        self.recorder = recorder
+        # on_migrate(fishData, destination) is called when a fish leaves
+        self.on_migrate = on_migrate
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.width = width
+        self.height = height
+        self.tick = 0
+        self.count = 0
+        self.index = {}          # fish id -> slot
+        self.seen = 0            # pond.changes at the last sync
+        self.grid = ArrayGrid(width, height, CROWD_RADIUS)
+        self.grid_fresh = False
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.capacity = capacity
+        self.x = np.zeros(capacity, np.int32)
+        self.y = np.zeros(capacity, np.int32)
+        self.prev_x = np.zeros(capacity, np.int32)
+        self.prev_y = np.zeros(capacity, np.int32)
+        self.angle = np.zeros(capacity, np.float64)
+        self.size = np.zeros(capacity, np.float64)
+        self.growth = np.zeros(capacity, np.float64)
+        self.age = np.zeros(capacity, np.int32)
+        self.lifetime = np.zeros(capacity, np.int32)
+        self.pheromone = np.zeros(capacity, np.int32)
+        self.breed_at = np.zeros(capacity, np.int32)
+        self.crowd = np.zeros(capacity, np.int32)
+        self.face_right = np.ones(capacity, np.bool_)
+        self.fish = np.empty(capacity, object)
+
+    def arrays(self):
+        return (self.x, self.y, self.prev_x, self.prev_y, self.angle, self.size, self.growth, self.age,
+                self.lifetime, self.pheromone, self.breed_at, self.crowd, self.face_right,
+                self.fish)
+
+    def grow_capacity(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        old = self.arrays()
+        self.allocate(capacity)
+        for new, previous in zip(self.arrays(), old):
+            new[:self.count] = previous[:self.count]
+
+    def add_many(self, fishes):
+        # Fish we already have just get their FishData replaced; repeats of an
+        # id within the batch are skipped
+        index = self.index
+        fresh = []
+        for fishData in fishes:
+            slot = index.get(fishData.id)
+            if slot is None:
+                index[fishData.id] = -1
+                fresh.append(fishData)
+            elif slot >= 0:
+                self.fish[slot] = fishData
+        fishes = fresh
+        k = len(fishes)
+        if k == 0:
+            return []
+        start = self.count
+        end = start + k
+        if end > self.capacity:
+            self.grow_capacity(end)
+        rng = self.rng
+        new = slice(start, end)
+        self.x[new] = rng.integers(0, self.width, k, endpoint=True)
+        self.y[new] = rng.integers(0, self.height, k, endpoint=True)
+        self.prev_x[new] = self.x[new]
+        self.prev_y[new] = self.y[new]
+        self.angle[new] = np.arctan2(rng.integers(-10, 10, k, endpoint=True),
+                                     rng.integers(-10, 10, k, endpoint=True))
+        self.size[new] = START_SIZE
+        self.age[new] = 0
+        self.lifetime[new] = [f.lifetime * 10 for f in fishes]
+        self.growth[new] = MAX_SIZE / (self.lifetime[new] / 2)
+        self.pheromone[new] = [f.pheromone for f in fishes]
+        self.breed_at[new] = [f.pheromoneThresh * 10 for f in fishes]
+        self.crowd[new] = [f.crowdThreshold for f in fishes]
+        self.face_right[new] = True
+        for slot, fishData in enumerate(fishes, start):
+            self.fish[slot] = fishData
+            self.index[fishData.id] = slot
+        self.count = end
+        self.grid_fresh = False
+        return [FishHandle(self, f) for f in fishes]
+
+    def add(self, fishData):
+        born = self.add_many([fishData])
+        return born[0] if born else None
+
+    def sync(self):
+        # Fish that showed up in the pond since the last tick (migrations),
+        # and fish someone else took out of it
+        pond = self.pond
+        latest = pond.changes
+        changes = pond.changesSince(self.seen)
+        self.seen = latest
+        if changes is None:
+            arrived = pond.fishes
+            removed = [fishId for fishId in self.index if fishId not in pond]
+        else:
+            arrived, removed = changes
+        left = []
+        slots = [self.index[fishId] for fishId in removed if fishId in self.index]
+        if slots:
+            gone = np.zeros(self.count, np.bool_)
+            gone[slots] = True
+            left = self.remove(gone, fromPond=False)
+        return self.add_many(arrived), left
+
+    def step(self):
+        # Advance one tick. Returns (handles that appeared, handles that left)
+        self.tick += 1
+        if self.state is not None:
+            self.state.drain()
+        born, left = self.sync()
+        if self.recorder is not None:
+            self.recorder.inputs(self.tick, [handle.fishData for handle in born],
+                                 [handle.fishData.id for handle in left])
+        n = self.count
+        if n == 0:
+            self.end_tick()
+            return born, left
+        live = slice(0, n)
+        x, y, angle, size = self.x[live], self.y[live], self.angle[live], self.size[live]
+        age, lifetime = self.age[live], self.lifetime[live]
+
+        self.prev_x[live] = x
+        self.prev_y[live] = y
+        dx = (SPEED_FISH * np.cos(angle)).astype(np.int32)
+        self.face_right[live] = dx >= 0
+        x += dx
+        y += (SPEED_FISH * np.sin(angle)).astype(np.int32)
+
+        bounce_x = (x + size > self.width) | (x < 0)
+        angle[bounce_x] = np.pi - angle[bounce_x]
+        bounce_y = (y + size > self.height) | (y < 0)
+        angle[bounce_y] = -angle[bounce_y]
+
+        age += 1
+        self.pheromone[live] += 1
+        growing = (age <= lifetime / 2) & (size < MAX_SIZE)
+        size[growing] += self.growth[live][growing]
+
+        self.grid.build(x, y)
+        self.grid_fresh = True
+        dead = (age >= lifetime) | (self.grid.block_counts() >= self.crowd[live])
+        migrating = np.flatnonzero(age == lifetime // 2)
+        if len(migrating):
+            rolls = self.rng.integers(0, 100, len(migrating), endpoint=True)
+            migrating = migrating[rolls > MIGRATION_CHANCE]
+            destinations = self.rng.integers(0, len(MIGRATION_TARGETS), len(migrating))
+            for slot, target in zip(migrating.tolist(), destinations.tolist()):
+                fishData = self.fish[slot]
+                # It leaves with its breeding progress
+                fishData.pheromone = int(self.pheromone[slot])
+                if self.on_migrate is not None:
+                    self.on_migrate(fishData, MIGRATION_TARGETS[target])
+                fishData.state = 'on-migrate'
+
+        for slot in np.flatnonzero(dead).tolist():
+            self.fish[slot].status = 'dead'
+        gone = dead
+        gone[migrating] = True
+        gone = self.remove(gone)
+        born += self.reproduce()
+        self.end_tick()
+        return born, left + gone
+
+    def end_tick(self):
+        if self.recorder is not None:
+            self.recorder.ticked(self)
+        if self.state is not None:
+            self.state.ticked(self)
+
+    def reproduce(self):
+        # Same as PondSimulation.reproduce: everyone over their pheromone
+        # threshold breeds as far as max_fish allows, longest-ready first
+        n = self.count
+        room = self.max_fish - n
+        if room <= 0:
+            return []
+        overdue = self.pheromone[:n] - self.breed_at[:n]
+        ready = np.flatnonzero(overdue >= 0)
+        if len(ready) == 0:
+            return []
+        if len(ready) > room:
+            order = np.lexsort((self.rng.random(len(ready)), -overdue[ready]))
+            ready = ready[order[:room]]
+        babies = [FishData(parent.genesis, parent.id, self.rng, self.ids)
+                  for parent in self.fish[ready].tolist()]
+        for baby in babies:
+            self.pond.addFish(baby)
+        start = self.count
+        born = self.add_many(babies)
+        new = slice(start, self.count)
+        self.x[new] = self.prev_x[new] = self.x[ready]
+        self.y[new] = self.prev_y[new] = self.y[ready]
+        self.pheromone[ready] = 0
+        return born
+
+    def remove(self, gone, fromPond=True):
+        # Drop the flagged slots, moving fish from the end into the holes
+        dead = np.flatnonzero(gone)
+        if len(dead) == 0:
+            return []
+        n = self.count
+        left = n - len(dead)
+        goneFish = self.fish[dead].tolist()
+        for fishData, pheromone in zip(goneFish, self.pheromone[dead].tolist()):
+            fishData.pheromone = pheromone
+            del self.index[fishData.id]
+        holes = dead[dead < left]
+        movers = np.arange(left, n)[~gone[left:n]]
+        for array in self.arrays():
+            array[holes] = array[movers]
+        self.fish[left:n] = None
+        for slot, fishData in zip(holes.tolist(), self.fish[holes].tolist()):
+            self.index[fishData.id] = slot
+        self.count = left
+        self.grid_fresh = False
+
+        if fromPond:
+            for fishData in goneFish:
+                self.pond.removeFishById(fishData.id)
+        return [FishHandle(self, f) for f in goneFish]
+
+    def spatial(self):
+        if not self.grid_fresh:
+            self.grid.build(self.x[:self.count], self.y[:self.count])
+            self.grid_fresh = True
+        return self.grid
+
+    def neighbours(self, fishData, radius):
+        # Other fish within radius of this one
+        slot = self.index[fishData.id]
+        slots = self.spatial().query_radius(self.x[slot], self.y[slot], radius)
+        return [self.fish[s] for s in slots.tolist() if s != slot]
+
+    def nearest(self, fishData, k, max_radius=None):
+        slot = self.index[fishData.id]
+        found = self.spatial().nearest(self.x[slot], self.y[slot], k, max_radius, exclude=slot)
+        return [self.fish[s] for distance, s in found]
+
+    def digest(self):
+        # Fingerprint of the whole simulation state, to check a replay
+        n = self.count
+        h = hashlib.blake2b(self.tick.to_bytes(4, "big"), digest_size=16)
+        h.update("\0".join(fishData.id for fishData in self.fish[:n].tolist()).encode())
+        for array in self.arrays()[:-1]:
+            h.update(array[:n].tobytes())
+        return h.digest()
+
+    def flush(self):
+        # Copy the per-fish counters kept in arrays back into the FishData,
+        # e.g. before a keyframe of the pond is sent
+        n = self.count
+        for fishData, pheromone in zip(self.fish[:n].tolist(),
+                                       self.pheromone[:n].tolist()):
+            fishData.pheromone = pheromone
+
+    def run(self, ticks):
+        for i in range(ticks):
+            self.step()
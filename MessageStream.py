@@ -0,0 +1,151 @@
+import asyncio
+import socket
+import struct
+import threading
+
+import Compression
+import WireFormat
+from Compression import CompressionError
+
+# Every message on the wire is a 4-byte big-endian length and a flags byte,
+# followed by the body. The flags byte is the Compression codec id of the body.
+HEADER = struct.Struct("!IB")
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+READ_SIZE = 65536
+
+
+class FrameError(Exception):
+    pass
+
+
+def make_frame(data, codec=Compression.NONE):
+    flags, body = Compression.compress(data, codec)
+    if len(body) > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {len(body)} bytes is too large")
+    return HEADER.pack(len(body), flags) + body
+
+
+def open_frame(flags, body):
+    try:
+        return Compression.decompress(flags, body)
+    except CompressionError as e:
+        raise FrameError(str(e))
+
+
+class MessageStream:
+    # Buffered reader/writer over a connected TCP socket. Reads are done in
+    # large chunks and split into frames, so a frame cut across several recv()
+    # calls or several frames merged in one recv() are both handled. Writes are
+    # serialized with a lock so threads sharing the socket never interleave.
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = bytearray()
+        self.write_lock = threading.Lock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Codec for outgoing frames, set once the peer has agreed to it
+        self.codec = Compression.NONE
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def frame(self, data):
+        return make_frame(data, self.codec)
+
+    def write_frame(self, data):
+        self.write_raw(self.frame(data))
+
+    def write_raw(self, frame):
+        with self.write_lock:
+            self.sock.sendall(frame)
+            self.bytes_sent += len(frame)
+
+    def read_frame(self):
+        # Returns the next frame body, or None when the peer closed the socket
+        while True:
+            if len(self.buffer) >= HEADER_SIZE:
+                length, flags = HEADER.unpack_from(self.buffer)
+                if length > MAX_FRAME_SIZE:
+                    raise FrameError(f"Frame of {length} bytes is too large")
+                end = HEADER_SIZE + length
+                if len(self.buffer) >= end:
+                    data = bytes(self.buffer[HEADER_SIZE:end])
+                    del self.buffer[:end]
+                    return open_frame(flags, data)
+            chunk = self.sock.recv(READ_SIZE)
+            if not chunk:
+                if self.buffer:
+                    raise FrameError("Connection closed in the middle of a frame")
+                return None
+            self.bytes_received += len(chunk)
+            self.buffer += chunk
+
+    def send(self, payload):
+        self.write_frame(WireFormat.encode(payload))
+
+    def recv(self):
+        data = self.read_frame()
+        if data is None:
+            return None
+        return WireFormat.decode(data)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class AsyncMessageStream:
+    # Same framing as MessageStream, on top of asyncio streams. send() only
+    # queues bytes on the transport; await drain() to apply backpressure.
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.codec = Compression.NONE
+
+    def frame(self, data):
+        return make_frame(data, self.codec)
+
+    def write_frame(self, data):
+        self.write_raw(self.frame(data))
+
+    def write_raw(self, frame):
+        self.writer.write(frame)
+        self.bytes_sent += len(frame)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def read_frame(self):
+        try:
+            header = await self.reader.readexactly(HEADER_SIZE)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise FrameError("Connection closed in the middle of a frame")
+            return None
+        length, flags = HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise FrameError(f"Frame of {length} bytes is too large")
+        try:
+            data = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise FrameError("Connection closed in the middle of a frame")
+        self.bytes_received += HEADER_SIZE + length
+        return open_frame(flags, data)
+
+    def send(self, payload):
+        self.write_frame(WireFormat.encode(payload))
+
+    async def recv(self):
+        data = await self.read_frame()
+        if data is None:
+            return None
+        return WireFormat.decode(data)
+
+    def close(self):
+        self.writer.close()
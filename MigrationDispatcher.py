@@ -0,0 +1,161 @@
+import queue
+import threading
+import time
+from collections import deque
+
+from Client import LinkLost, RequestTimeout
+
+# Sends a pond's outgoing migrations from one long-lived worker thread.
+#
+# The simulation calls add() for every fish that leaves during a tick and
+# flush() once the tick is over; flush() groups the tick's fish by
+# destination and hands the batch to the worker, which sends one MIGRATE per
+# destination. A burst of migrations therefore costs one queue put per tick
+# and one message per destination pond, not a thread and a message per fish.
+#
+# add() and flush() are only called from the simulation thread, so the
+# pending batch needs no lock; the worker only ever sees finished batches.
+#
+# Sends are pipelined: the worker does not wait for the answer. Each
+# MIGRATE's Future reports back once the destination pond has ACKed it (or
+# the hub bounced it). A MIGRATE that could not be sent at all is sent
+# again after a growing delay, up to MAX_ATTEMPTS times, after which the
+# fish swim back home. Retries never go through the bounded batch queue: the
+# answer may come on the worker itself, which must not block on its own
+# queue, so they wait in a deque that only the worker empties. One
+# that was sent but never answered (timeout, lost connection) may well have
+# arrived, and the fish may since have died there: it is neither sent again
+# nor brought home, only counted as unconfirmed.
+#
+# AsyncMigrationDispatcher does the same for an AsyncClient without a thread
+# of its own: batches are sent from the client's event loop, and retries
+# are scheduled on it.
+MAX_BACKLOG = 256        # batches waiting for the worker before flush() blocks
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1          # seconds before the first retry, doubled for each next
+# Failures after which the MIGRATE may have been delivered
+UNCONFIRMED = (RequestTimeout, LinkLost)
+EXPIRE_INTERVAL = 1      # seconds between checks for unanswered MIGRATEs
+
+
+class MigrationDispatcher:
+    def __init__(self, client, max_backlog=MAX_BACKLOG):
+        self.client = client
+        self.pending = {}            # destination -> [FishData]
+        self.delivered = 0
+        self.bounced = 0
+        self.returned = 0
+        self.unconfirmed = 0
+        self.start(max_backlog)
+
+    def start(self, max_backlog):
+        self.batches = queue.Queue(max_backlog)
+        # (due, destination, fishes, attempt), appended from any thread
+        self.retries = deque()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, batch):
+        # batch: [(destination, fishes, attempt)]
+        self.batches.put(batch)
+
+    def retry(self, destination, fishes, attempt):
+        # Any thread; the worker sends it once it is due
+        due = time.monotonic() + RETRY_DELAY * 2 ** (attempt - 2)
+        self.retries.append((due, destination, fishes, attempt))
+
+    def add(self, fishData, destination):
+        # Simulation thread; usable as the simulation's on_migrate
+        fishes = self.pending.get(destination)
+        if fishes is None:
+            fishes = self.pending[destination] = []
+        fishes.append(fishData)
+
+    def flush(self):
+        # Simulation thread, end of a tick
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        self.submit([(destination, fishes, 1)
+                     for destination, fishes in batch.items()])
+
+    def close(self):
+        # Sends whatever is pending, then lets the worker finish
+        self.flush()
+        self.batches.put(None)
+        self.worker.join()
+
+    def run(self):
+        while True:
+            try:
+                batch = self.batches.get(timeout=EXPIRE_INTERVAL)
+            except queue.Empty:
+                batch = ()
+            if batch is None:
+                self.abandon_retries()
+                return
+            self.send_batch(batch)
+            self.send_retries()
+            self.client.expire_requests()
+
+    def send_retries(self):
+        # Worker thread. Only what is in the deque now: a retry that fails
+        # again while we send is appended behind them
+        now = time.monotonic()
+        for i in range(len(self.retries)):
+            retry = self.retries.popleft()
+            due, destination, fishes, attempt = retry
+            if due <= now:
+                self.send(destination, fishes, attempt)
+            else:
+                self.retries.append(retry)
+
+    def abandon_retries(self):
+        # Closing: fish that were never sent swim back home
+        while self.retries:
+            due, destination, fishes, attempt = self.retries.popleft()
+            self.returned += len(fishes)
+            self.client.welcome(fishes)
+
+    def send_batch(self, batch):
+        for destination, fishes, attempt in batch:
+            self.send(destination, fishes, attempt)
+
+    def send(self, destination, fishes, attempt):
+        future = self.client.migrate_fishes(fishes, destination)
+        future.add_done_callback(
+            lambda future: self.answered(future, destination, fishes, attempt))
+
+    def answered(self, future, destination, fishes, attempt):
+        # Runs on whichever thread resolved the future
+        error = future.exception()
+        if error is None:
+            if future.result() == "bounced":
+                self.bounced += len(fishes)
+            else:
+                self.delivered += len(fishes)
+        elif isinstance(error, UNCONFIRMED):
+            print(f"Migration of {len(fishes)} fish to {destination} unconfirmed: {error}")
+            self.unconfirmed += len(fishes)
+        elif attempt < MAX_ATTEMPTS:
+            self.retry(destination, fishes, attempt + 1)
+        else:
+            print(f"Migration of {len(fishes)} fish to {destination} failed: {error}")
+            self.returned += len(fishes)
+            self.client.welcome(fishes)
+
+
+class AsyncMigrationDispatcher(MigrationDispatcher):
+    # The client's loop expires unanswered requests itself
+    def start(self, max_backlog):
+        pass
+
+    def submit(self, batch):
+        self.client.loop.call(self.send_batch, batch)
+
+    def retry(self, destination, fishes, attempt):
+        self.client.loop.call_later(RETRY_DELAY * 2 ** (attempt - 2),
+                                    self.send, destination, fishes, attempt)
+
+    def close(self):
+        self.flush()
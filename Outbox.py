@@ -0,0 +1,51 @@
+import threading
+from collections import deque
+
+# Pond state updates. A newer SEND keyframe makes every older SEND/DELTA of
+# the same pond useless, and a receiver that misses a DELTA just waits for the
+# next keyframe, so these are the only messages we ever drop.
+STATE_ACTIONS = ("SEND", "DELTA")
+OUTBOX_SIZE = 64
+
+
+class Outbox:
+    # Bounded queue of encoded frames waiting to be written to one pond.
+    # put() never blocks the caller; when the queue is full it drops stale
+    # state updates instead. Everything else (MIGRATE, BOUNCE, !DISCONNECT,
+    # ACK, SUMMARY) is always queued, even past maxsize.
+    def __init__(self, maxsize=OUTBOX_SIZE, on_ready=None):
+        self.maxsize = maxsize
+        self.on_ready = on_ready
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, frame, action, pondName=None):
+        with self.lock:
+            if len(self.queue) >= self.maxsize and action in STATE_ACTIONS:
+                if not self.make_room(action, pondName):
+                    self.dropped += 1
+                    return False
+            self.queue.append((frame, action, pondName))
+        if self.on_ready is not None:
+            self.on_ready()
+        return True
+
+    def make_room(self, action, pondName):
+        # Only a keyframe can replace what is queued for its pond
+        if action != "SEND":
+            return False
+        kept = deque(entry for entry in self.queue
+                     if not (entry[1] in STATE_ACTIONS and entry[2] == pondName))
+        self.dropped += len(self.queue) - len(kept)
+        self.queue = kept
+        return len(self.queue) < self.maxsize
+
+    def pop_all(self):
+        with self.lock:
+            frames = [entry[0] for entry in self.queue]
+            self.queue.clear()
+        return frames
@@ -4,4 +4,7 @@ from PondData import PondData
 class Payload:
     def __init__(self):
         self.action =  ""
-        self.data = object
\ No newline at end of file
+        self.data = object
+        # Correlation id: a request's id comes back on the ACK or BOUNCE that
+        # answers it. 0 means nobody is waiting for an answer.
+        self.id = 0
@@ -1,25 +1,95 @@
+CHANGE_LOG_SIZE = 4096
+
+
 class PondData:
+    # Fish are kept in a dict by id, in the order they were added, so lookup,
+    # update and removal do not scan the pond. Every add/set/remove bumps
+    # `changes` and is logged, so a consumer that remembers the `changes` value
+    # it last saw can ask for just what happened since (changesSince) instead
+    # of rescanning the pond.
+    #
+    # `version` is separate: it is the sync version used by PondDelta.
     def __init__(self, pondName):
         self.pondName = pondName
-        self.fishes = []
+        self.index = {}          # fish id -> FishData
+        self.version = 0
+        self.changes = 0
+        self.log = []            # (change number, fish id, added?)
+        self.logStart = 0        # changesSince() needs n >= logStart
 
     def __str__(self):
         fishId = ""
         for f in self.fishes:
             fishId += f.getId() + " "
         return self.pondName + " " + fishId
-    
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(list(self.index.values()))
+
+    def __contains__(self, fishId):
+        return fishId in self.index
+
+    @property
+    def fishes(self):
+        # A copy, in insertion order
+        return list(self.index.values())
+
+    @fishes.setter
+    def fishes(self, fishes):
+        # Replacing every fish at once; changesSince() from before this point
+        # can not be answered
+        self.index = {fish.id: fish for fish in fishes}
+        self.changes += 1
+        self.log = []
+        self.logStart = self.changes
+
+    def record(self, fishId, added):
+        self.changes += 1
+        self.log.append((self.changes, fishId, added))
+        if len(self.log) > 2 * CHANGE_LOG_SIZE:
+            del self.log[:-CHANGE_LOG_SIZE]
+            self.logStart = self.log[0][0] - 1
+
     def addFish(self, fishData):
-        self.fishes.append(fishData)
+        # A fish with an id we already have replaces it
+        self.index.pop(fishData.id, None)
+        self.index[fishData.id] = fishData
+        self.record(fishData.id, True)
 
     def getFishById( self, fishId):
-        res = None
-        for fish in self.fishes:
-            if fish.id == fishId:
-                return fish
+        return self.index.get(fishId)
+
+    def removeFishById(self, fishId):
+        if self.index.pop(fishId, None) is None:
+            return False
+        self.record(fishId, False)
+        return True
 
     def setFish( self, newFishData):
-        for i in range(len(self.fishes)):
-            if self.fishes[i].id == newFishData.id:
-                self.fishes[i] = newFishData
-                return
\ No newline at end of file
+        if newFishData.id in self.index:
+            self.index[newFishData.id] = newFishData
+            self.changes += 1
+
+    def changesSince(self, n):
+        # (fish added since change n that are still here, ids removed since n)
+        # or None when n is too old for the log and the caller must rescan
+        if n < self.logStart:
+            return None
+        log = self.log
+        i = len(log)
+        while i > 0 and log[i - 1][0] > n:
+            i -= 1
+        added = {}
+        removed = set()
+        for number, fishId, wasAdded in log[i:]:
+            if wasAdded:
+                added[fishId] = True
+                removed.discard(fishId)
+            else:
+                added.pop(fishId, None)
+                removed.add(fishId)
+        addedFish = [self.index[fishId] for fishId in added if fishId in self.index]
+        return addedFish, removed
@@ -0,0 +1,56 @@
+class PondDelta:
+    # Changes to one pond between two versions: fish that were added, fish
+    # whose synced fields changed, and ids of fish that are gone.
+    def __init__(self, pondName, version, baseVersion):
+        self.pondName = pondName
+        self.version = version
+        self.baseVersion = baseVersion
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def __str__(self):
+        return (f"{self.pondName} v{self.baseVersion}->v{self.version} "
+                f"+{len(self.added)} ~{len(self.changed)} -{len(self.removed)}")
+
+    def isEmpty(self):
+        return not (self.added or self.changed or self.removed)
+
+    def apply(self, pond):
+        # Only valid on top of the version it was made against
+        if pond.version != self.baseVersion:
+            return False
+        for fishId in self.removed:
+            pond.removeFishById(fishId)
+        for fish in self.changed:
+            pond.setFish(fish)
+        for fish in self.added:
+            pond.addFish(fish)
+        pond.version = self.version
+        return True
+
+
+def takeSnapshot(fishes):
+    # id -> synced fields, used as the base for the next diff
+    return {fish.id: fish.syncState() for fish in fishes}
+
+
+def diffPond(pond, snapshot, baseVersion):
+    # Also moves snapshot forward to the state the delta describes
+    delta = PondDelta(pond.pondName, baseVersion + 1, baseVersion)
+    seen = set()
+    for fish in pond.fishes:
+        seen.add(fish.id)
+        state = fish.syncState()
+        old = snapshot.get(fish.id)
+        if old is None:
+            delta.added.append(fish)
+        elif old != state:
+            delta.changed.append(fish)
+        else:
+            continue
+        snapshot[fish.id] = state
+    delta.removed = [fishId for fishId in snapshot if fishId not in seen]
+    for fishId in delta.removed:
+        del snapshot[fishId]
+    return delta
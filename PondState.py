@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from collections import deque
+
+from PondData import PondData
+
+# Who may touch a pond. The simulation owns the live PondData and is the only
+# thread that reads or writes it while it runs. Network threads never touch
+# it: fish arriving from the hub go into `inbox`, which the simulation drains
+# once at the start of each tick, and what goes out to the hub is `snapshot`,
+# a copy of the pond the simulation publishes at the end of a tick when asked
+# for one. The two sides only ever exchange whole objects through a deque
+# and a reference swap, so neither waits on the other's locks or I/O.
+#
+# Until a simulation attaches, the thread that calls deliver()/latest() is
+# taken to own the pond (loadgen and the scripted clients work that way).
+#
+# latest_async() is latest() for code on an event loop: it waits for the
+# snapshot without blocking the loop.
+SNAPSHOT_WAIT = 0.5
+
+
+class PondState:
+    def __init__(self, pond):
+        self.pond = pond
+        self.inbox = deque()
+        self.snapshot = None
+        self.wanted = threading.Event()
+        self.fresh = threading.Event()
+        self.waiters = deque()   # (loop, asyncio.Future) from latest_async()
+        self.simulated = False
+
+    def attach(self):
+        # Called by the simulation that owns the pond from now on
+        self.simulated = True
+
+    def deliver(self, fishData):
+        # Any thread: hand a fish to the pond
+        if self.simulated:
+            self.inbox.append(fishData)
+        else:
+            self.pond.addFish(fishData)
+
+    def drain(self):
+        # Simulation thread, start of a tick
+        inbox = self.inbox
+        while inbox:
+            self.pond.addFish(inbox.popleft())
+
+    def publish(self):
+        # Owner thread: publish a copy of the pond as it is right now
+        frame = PondData(self.pond.pondName)
+        frame.fishes = [fishData.copy() for fishData in self.pond.fishes]
+        self.snapshot = frame
+        self.wanted.clear()
+        self.fresh.set()
+        waiters = self.waiters
+        while waiters:
+            loop, waiter = waiters.popleft()
+            loop.call_soon_threadsafe(resolve, waiter, frame)
+        return frame
+
+    def ticked(self, sim):
+        # Simulation thread, end of a tick
+        if self.wanted.is_set():
+            sim.flush()
+            self.publish()
+
+    def latest(self, timeout=SNAPSHOT_WAIT):
+        # Any thread: a snapshot taken at the end of the next tick, or the
+        # last one published if the simulation does not get to a tick within
+        # timeout (None if there has never been one)
+        if not self.simulated:
+            return self.publish()
+        self.fresh.clear()
+        self.wanted.set()
+        self.fresh.wait(timeout)
+        return self.snapshot
+
+    async def latest_async(self, timeout=SNAPSHOT_WAIT):
+        # Event loop: same as latest()
+        if not self.simulated:
+            return self.publish()
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self.waiters.append((loop, waiter))
+        self.wanted.set()
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return self.snapshot
+
+
+def resolve(waiter, frame):
+    if not waiter.done():
+        waiter.set_result(frame)
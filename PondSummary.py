@@ -0,0 +1,13 @@
+class PondSummary:
+    # What a pond subscribed to at COUNT detail receives about another pond
+    # instead of its fish: how many there are. len() works as on PondData.
+    def __init__(self, pondName, version, count):
+        self.pondName = pondName
+        self.version = version
+        self.count = count
+
+    def __str__(self):
+        return f"{self.pondName} v{self.version} {self.count} fish"
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,155 @@
+import json
+import random
+import struct
+
+import numpy as np
+
+import FishData
+import WireFormat
+from FishEngine import FishEngine
+from Payload import Payload
+from PondData import PondData
+from PondDelta import PondDelta
+from Simulation import PondSimulation
+
+# Record/replay of one pond's simulation. With a fixed seed the simulation is
+# deterministic apart from what arrives over the network, so a session log
+# only has to hold the seed and settings plus, for every tick, the fish the
+# network put into the pond (migrations, bounces) or took out of it. replay.py
+# feeds those back in at the same ticks, headless, and checks the state
+# digests taken during the live run.
+#
+# File layout: MAGIC, then records of RECORD (kind, tick, body length) + body
+#   LOG_HEADER  json settings: seed, pond, engine, max_fish, width, height
+#   LOG_INPUT   WireFormat DELTA: fish added and ids removed before `tick`
+#   LOG_CHECK   simulation digest after `tick`
+MAGIC = b"FISHLOG1"
+RECORD = struct.Struct("!BII")
+LOG_HEADER = 0
+LOG_INPUT = 1
+LOG_CHECK = 2
+CHECK_INTERVAL = 30
+
+ENGINES = {"numpy": FishEngine, "python": PondSimulation}
+
+
+class SessionLogError(Exception):
+    pass
+
+
+def pond_rng(seed, pondName, engine="numpy"):
+    # Every pond gets its own stream, so ponds seeded alike still differ
+    if engine == "numpy":
+        return np.random.default_rng([seed, FishData.pondTag(pondName)])
+    return random.Random(f"{seed}:{pondName}")
+
+
+def make_simulation(pond, seed, engine="numpy", recorder=None, **settings):
+    # Seeded simulation of pond; offspring ids come from a seeded allocator
+    # too, so they are the same every time
+    ids = FishData.IdAllocator(pond.pondName, random.Random(f"ids:{seed}:{pond.pondName}"))
+    return ENGINES[engine](pond, rng=pond_rng(seed, pond.pondName, engine),
+                           recorder=recorder, ids=ids, **settings)
+
+
+class Recorder:
+    def __init__(self, path, seed, pondName, engine="numpy", **settings):
+        self.file = open(path, "wb")
+        self.pondName = pondName
+        self.lastCheck = 0
+        self.sim = None
+        header = dict(settings, seed=seed, pond=pondName, engine=engine)
+        self.file.write(MAGIC)
+        self.write(LOG_HEADER, 0, json.dumps(header).encode("utf-8"))
+
+    def write(self, kind, tick, body):
+        self.file.write(RECORD.pack(kind, tick, len(body)))
+        self.file.write(body)
+
+    def inputs(self, tick, added, removed):
+        if not added and not removed:
+            return
+        delta = PondDelta(self.pondName, tick, tick - 1)
+        delta.added = list(added)
+        delta.removed = list(removed)
+        payload = Payload()
+        payload.action = "DELTA"
+        payload.data = delta
+        self.write(LOG_INPUT, tick, WireFormat.encode(payload))
+
+    def ticked(self, sim):
+        self.sim = sim
+        if sim.tick % CHECK_INTERVAL == 0:
+            self.check(sim)
+
+    def check(self, sim):
+        self.write(LOG_CHECK, sim.tick, sim.digest())
+        self.lastCheck = sim.tick
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.sim is not None and self.sim.tick != self.lastCheck:
+            self.check(self.sim)
+        self.file.close()
+
+
+def read_log(path):
+    # (header dict, [(kind, tick, body), ...])
+    with open(path, "rb") as log:
+        data = log.read()
+    if not data.startswith(MAGIC):
+        raise SessionLogError(f"{path} is not a session log")
+    offset = len(MAGIC)
+    records = []
+    while offset < len(data):
+        if offset + RECORD.size > len(data):
+            raise SessionLogError("Truncated record header")
+        kind, tick, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        body = data[offset:offset + length]
+        if len(body) != length:
+            raise SessionLogError("Truncated record")
+        offset += length
+        records.append((kind, tick, body))
+    if not records or records[0][0] != LOG_HEADER:
+        raise SessionLogError("Session log has no header")
+    return json.loads(records[0][2]), records[1:]
+
+
+class Replay:
+    def __init__(self, path):
+        self.header, records = read_log(path)
+        settings = dict(self.header)
+        seed = settings.pop("seed")
+        pondName = settings.pop("pond")
+        engine = settings.pop("engine")
+        self.pond = PondData(pondName)
+        self.sim = make_simulation(self.pond, seed, engine, **settings)
+        self.inputs = {}
+        self.checks = {}
+        for kind, tick, body in records:
+            if kind == LOG_INPUT:
+                self.inputs[tick] = WireFormat.decode(body).data
+            elif kind == LOG_CHECK:
+                self.checks[tick] = body
+        self.ticks = max(list(self.inputs) + list(self.checks) + [0])
+        self.mismatches = []
+
+    def step(self):
+        tick = self.sim.tick + 1
+        delta = self.inputs.get(tick)
+        if delta is not None:
+            for fishId in delta.removed:
+                self.pond.removeFishById(fishId)
+            for fish in delta.added:
+                self.pond.addFish(fish)
+        self.sim.step()
+        expected = self.checks.get(tick)
+        if expected is not None and self.sim.digest() != expected:
+            self.mismatches.append(tick)
+
+    def run(self):
+        while self.sim.tick < self.ticks:
+            self.step()
+        return not self.mismatches
@@ -0,0 +1,29 @@
+import bisect
+import zlib
+
+# Which shard of a port-sharded hub (shardserver.py) a pond belongs to.
+# Kept apart from shardserver.py so that clients can use it without
+# importing the server.
+RING_REPLICAS = 64
+
+
+class HashRing:
+    # Consistent hashing of pond names onto shards
+    def __init__(self, shards, replicas=RING_REPLICAS):
+        self.points = []
+        self.owners = []
+        ring = sorted((zlib.crc32(f"{shard}:{i}".encode()), shard)
+                      for shard in range(shards) for i in range(replicas))
+        for point, shard in ring:
+            self.points.append(point)
+            self.owners.append(shard)
+
+    def shard_for(self, pondName):
+        point = zlib.crc32(pondName.encode("utf-8"))
+        idx = bisect.bisect(self.points, point) % len(self.points)
+        return self.owners[idx]
+
+
+def shard_address(pondName, addr, shards):
+    # Where a pond should connect when the hub at addr is sharded by port
+    return (addr[0], addr[1] + HashRing(shards).shard_for(pondName))
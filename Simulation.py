@@ -0,0 +1,234 @@
+import hashlib
+import math
+import random
+import struct
+
+from FishData import FishData, allocatorFor
+from SpatialGrid import SpatialGrid
+
+# Pond simulation without any rendering. Works on the FishData in a PondData
+# and can run as fast as the CPU allows; main.py draws a view over it.
+
+SPEED_FISH = 5            # speed of fish
+MAX_FISH = 100            # max number of fishs
+TPS = 30
+MAX_SIZE = 48
+START_SIZE = 6
+# A fish dies of crowding when at least crowdThreshold fish (itself included)
+# are within CROWD_RADIUS of it
+CROWD_RADIUS = 48
+
+POND_WIDTH = 800
+POND_HEIGHT = 600
+
+# Ponds a fish may try to migrate to at half its lifetime
+MIGRATION_TARGETS = ['peem', 'sick-salmon', "dang"]
+MIGRATION_CHANCE = 80     # migrates when randint(0, 100) > MIGRATION_CHANCE
+
+
+class FishBody:
+    # Everything the simulation knows about one fish besides its FishData
+    def __init__(self, fishData, rng, width=POND_WIDTH, height=POND_HEIGHT):
+        self.fishData = fishData
+        self.lifetime = fishData.lifetime * 10
+        self.size = START_SIZE
+        self.x = rng.randint(0, width)
+        self.y = rng.randint(0, height)
+        self.prev_x = self.x
+        self.prev_y = self.y
+        self.angle = math.atan2(rng.randint(-10, 10), rng.randint(-10, 10))
+        self.speed = SPEED_FISH
+        self.age = 0
+        self.frame = 0
+        self.face_right = True
+        self.growth_rate = MAX_SIZE / (self.lifetime / 2)
+
+    def move(self):
+        self.prev_x = self.x
+        self.prev_y = self.y
+        dx = int(self.speed * math.cos(self.angle))
+        self.face_right = dx >= 0
+        self.x += dx
+        self.y += int(self.speed * math.sin(self.angle))
+
+    def position(self, alpha=1.0):
+        # Where the fish is alpha of the way from the previous tick to this one
+        return (int(self.prev_x + (self.x - self.prev_x) * alpha),
+                int(self.prev_y + (self.y - self.prev_y) * alpha))
+
+    def stay_in_pond(self, width, height):
+        if self.x + self.size > width or self.x < 0:
+            self.angle = math.pi - self.angle
+
+        if self.y + self.size > height or self.y < 0:
+            self.angle = -self.angle
+
+    def grow(self):
+        if self.age <= (self.lifetime / 2) and self.size < MAX_SIZE:
+            self.size += self.growth_rate
+
+    def alive(self):
+        return (self.fishData.status != 'dead'
+                and self.fishData.state != 'on-migrate')
+
+
+def ready_to_breed(fishData):
+    return fishData.pheromone >= fishData.pheromoneThresh * 10
+
+
+class PondSimulation:
+    def __init__(self, pond, on_migrate=None, rng=None,
+                 width=POND_WIDTH, height=POND_HEIGHT, max_fish=MAX_FISH, recorder=None,
+                 ids=None, state=None):
+        self.pond = pond
+        # PondState shared with the network threads, if any
+        self.state = state
+        if state is not None:
+            state.attach()
+        # IdAllocator for offspring
+        self.ids = ids if ids is not None else allocatorFor(pond.pondName)
+        self.max_fish = max_fish
+        # SessionLog.Recorder that logs what the network put in the pond
+        self.recorder = recorder
+        # on_migrate(fishData, destination) is called when a fish leaves
+        self.on_migrate = on_migrate
+        self.rng = rng or random.Random()
+        self.width = width
+        self.height = height
+        self.bodies = {}
+        self.seen = 0            # pond.changes at the last sync
+        self.grid = SpatialGrid(CROWD_RADIUS)
+        self.tick = 0
+
+    def add(self, fishData):
+        body = FishBody(fishData, self.rng, self.width, self.height)
+        self.bodies[fishData.id] = body
+        self.grid.insert(fishData.id, body.x, body.y)
+        return body
+
+    def neighbours(self, body, radius):
+        # Other bodies within radius of this one
+        return [self.bodies[key] for key in self.grid.query_radius(body.x, body.y, radius)
+                if key != body.fishData.id]
+
+    def nearest(self, body, k, max_radius=None):
+        return [self.bodies[key] for distance, key in
+                self.grid.nearest(body.x, body.y, k, max_radius, exclude=body.fishData.id)]
+
+    def sync(self):
+        # Fish that showed up in the pond since the last tick (migrations),
+        # and bodies of fish someone else took out of it
+        pond = self.pond
+        latest = pond.changes
+        changes = pond.changesSince(self.seen)
+        self.seen = latest
+        if changes is None:
+            arrived = pond.fishes
+            removed = [fishId for fishId in self.bodies if fishId not in pond]
+        else:
+            arrived, removed = changes
+        born = []
+        for fishData in arrived:
+            body = self.bodies.get(fishData.id)
+            if body is None:
+                born.append(self.add(fishData))
+            else:
+                body.fishData = fishData
+        left = []
+        for fishId in removed:
+            body = self.bodies.pop(fishId, None)
+            if body is not None:
+                self.grid.remove(fishId)
+                left.append(body)
+        return born, left
+
+    def step(self):
+        # Advance one tick. Returns (bodies that appeared, bodies that left)
+        # so a view can add and remove its sprites. Babies are made in their
+        # own phase after every fish has moved and the dead are gone, so the
+        # update pass never sees the population change under it.
+        self.tick += 1
+        if self.state is not None:
+            self.state.drain()
+        born, left = self.sync()
+        if self.recorder is not None:
+            self.recorder.inputs(self.tick, [body.fishData for body in born],
+                                 [body.fishData.id for body in left])
+        for body in list(self.bodies.values()):
+            self.step_fish(body)
+        gone = [body for body in self.bodies.values() if not body.alive()]
+        for body in gone:
+            del self.bodies[body.fishData.id]
+            self.grid.remove(body.fishData.id)
+            self.pond.removeFishById(body.fishData.id)
+        born += self.reproduce()
+        self.end_tick()
+        return born, left + gone
+
+    def end_tick(self):
+        if self.recorder is not None:
+            self.recorder.ticked(self)
+        if self.state is not None:
+            self.state.ticked(self)
+
+    def flush(self):
+        # Everything already lives in the FishData
+        pass
+
+    def digest(self):
+        # Fingerprint of the whole simulation state, to check a replay
+        h = hashlib.blake2b(struct.pack("!I", self.tick), digest_size=16)
+        for fishId, body in self.bodies.items():
+            h.update(fishId.encode())
+            h.update(struct.pack("!iidddii", body.x, body.y, body.angle, body.size,
+                                 body.growth_rate, body.age, body.fishData.pheromone))
+        return h.digest()
+
+    def reproduce(self):
+        # Every fish over its pheromone threshold breeds, as far as MAX_FISH
+        # allows. When there is not room for all of them, the ones that have
+        # been ready the longest go first (ties drawn at random); the rest
+        # keep their pheromone and are further up the queue next tick.
+        ready = [body for body in self.bodies.values() if ready_to_breed(body.fishData)]
+        room = self.max_fish - len(self.bodies)
+        if not ready or room <= 0:
+            return []
+        if len(ready) > room:
+            ready.sort(key=lambda body: (body.fishData.pheromoneThresh * 10
+                                         - body.fishData.pheromone, self.rng.random()))
+            ready = ready[:room]
+        return [self.procreate(body) for body in ready]
+
+    def step_fish(self, body):
+        fishData = body.fishData
+        body.move()
+        self.grid.move(fishData.id, body.x, body.y)
+        body.frame += 1
+        body.stay_in_pond(self.width, self.height)
+        body.age += 1
+        fishData.pheromone += 1
+        body.grow()
+        if body.age >= body.lifetime:
+            fishData.status = 'dead'
+        if self.grid.count_radius(body.x, body.y, CROWD_RADIUS) >= fishData.crowdThreshold:
+            fishData.status = 'dead'
+        if body.age == body.lifetime // 2 and self.rng.randint(0, 100) > MIGRATION_CHANCE:
+            destination = self.rng.choice(MIGRATION_TARGETS)
+            if self.on_migrate is not None:
+                self.on_migrate(fishData, destination)
+            fishData.state = 'on-migrate'
+
+    def procreate(self, body):
+        fishData = body.fishData
+        baby = FishData(fishData.genesis, fishData.id, self.rng, self.ids)
+        self.pond.addFish(baby)
+        child = self.add(baby)
+        child.x = child.prev_x = body.x
+        child.y = child.prev_y = body.y
+        self.grid.move(baby.id, child.x, child.y)
+        fishData.pheromone = 0
+        return child
+
+    def run(self, ticks):
+        for i in range(ticks):
+            self.step()
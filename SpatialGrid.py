@@ -0,0 +1,210 @@
+import heapq
+import math
+
+import numpy as np
+
+# Uniform grids over fish positions, so "who is near this fish" costs a look
+# at a few cells instead of a scan of the whole pond.
+#
+# SpatialGrid is updated one fish at a time (insert/move/remove) and suits
+# per-object code like Simulation.PondSimulation. ArrayGrid is rebuilt from
+# FishEngine's position arrays once per tick with a couple of sorts and
+# counts in NumPy, which for a vectorized engine is much cheaper than moving
+# fish between cells one by one in Python.
+
+CELL_SIZE = 48
+
+
+class SpatialGrid:
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}          # (cx, cy) -> {key: (x, y)}
+        self.where = {}          # key -> (cx, cy)
+
+    def __len__(self):
+        return len(self.where)
+
+    def cell(self, x, y):
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def insert(self, key, x, y):
+        cell = self.cell(x, y)
+        self.cells.setdefault(cell, {})[key] = (x, y)
+        self.where[key] = cell
+
+    def move(self, key, x, y):
+        # Only touches the cell dicts when the fish crosses into another cell
+        old = self.where[key]
+        cell = self.cell(x, y)
+        if cell == old:
+            self.cells[cell][key] = (x, y)
+            return
+        members = self.cells[old]
+        del members[key]
+        if not members:
+            del self.cells[old]
+        self.cells.setdefault(cell, {})[key] = (x, y)
+        self.where[key] = cell
+
+    def remove(self, key):
+        cell = self.where.pop(key, None)
+        if cell is None:
+            return False
+        members = self.cells[cell]
+        del members[key]
+        if not members:
+            del self.cells[cell]
+        return True
+
+    def ring(self, cx, cy, r):
+        # Cells at Chebyshev distance exactly r from (cx, cy)
+        if r == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-r, r + 1):
+            yield (cx + dx, cy - r)
+            yield (cx + dx, cy + r)
+        for dy in range(-r + 1, r):
+            yield (cx - r, cy + dy)
+            yield (cx + r, cy + dy)
+
+    def query_radius(self, x, y, radius):
+        # Keys of everything within radius of (x, y)
+        found = []
+        r2 = radius * radius
+        x0, y0 = self.cell(x - radius, y - radius)
+        x1, y1 = self.cell(x + radius, y + radius)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                members = self.cells.get((cx, cy))
+                if not members:
+                    continue
+                for key, (px, py) in members.items():
+                    if (px - x) ** 2 + (py - y) ** 2 <= r2:
+                        found.append(key)
+        return found
+
+    def count_radius(self, x, y, radius):
+        return len(self.query_radius(x, y, radius))
+
+    def nearest(self, x, y, k, max_radius=None, exclude=None):
+        # Up to k (distance, key) pairs closest to (x, y), nearest first.
+        # Searches outwards ring by ring and stops once no unvisited cell can
+        # hold anything closer than the k-th best so far.
+        limit = math.inf if max_radius is None else max_radius
+        best = []                 # max-heap of (-distance, key)
+        cx, cy = self.cell(x, y)
+        seen = 0
+        r = 0
+        while seen < len(self.where):
+            # Anything in ring r is at least (r - 1) cells away
+            reach = (r - 1) * self.cell_size
+            if reach > limit or (len(best) == k and reach > -best[0][0]):
+                break
+            for cell in self.ring(cx, cy, r):
+                members = self.cells.get(cell)
+                if not members:
+                    continue
+                seen += len(members)
+                for key, (px, py) in members.items():
+                    if key == exclude:
+                        continue
+                    distance = math.hypot(px - x, py - y)
+                    if distance > limit:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, key))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, key))
+            r += 1
+        return sorted((-d, key) for d, key in best)
+
+
+class ArrayGrid:
+    # Read-only grid over the first n entries of parallel x/y arrays
+    def __init__(self, width, height, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.cols = int(width // cell_size) + 1
+        self.rows = int(height // cell_size) + 1
+        self.n = 0
+
+    def cells_of(self, x, y):
+        cx = np.clip(x // self.cell_size, 0, self.cols - 1).astype(np.intp)
+        cy = np.clip(y // self.cell_size, 0, self.rows - 1).astype(np.intp)
+        return cx, cy
+
+    def build(self, x, y):
+        self.x = x
+        self.y = y
+        self.n = len(x)
+        cx, cy = self.cells_of(x, y)
+        self.cx = cx
+        self.cy = cy
+        self.cell = cy * self.cols + cx
+        self.counts = np.bincount(self.cell, minlength=self.cols * self.rows)
+        self.order = None
+
+    def sort(self):
+        # Slots sorted by cell; the slots of cell c are order[starts[c]:starts[c + 1]].
+        # Only needed for point queries, so done on the first one after build()
+        self.order = np.argsort(self.cell, kind="stable")
+        self.starts = np.zeros(len(self.counts) + 1, np.intp)
+        np.cumsum(self.counts, out=self.starts[1:])
+
+    def block_counts(self):
+        # For every slot, the number of slots in the 3x3 block of cells
+        # around its own (itself included)
+        counts = self.counts.reshape(self.rows, self.cols)
+        padded = np.pad(counts, 1)
+        block = np.zeros_like(counts)
+        for dy in range(3):
+            for dx in range(3):
+                block += padded[dy:dy + self.rows, dx:dx + self.cols]
+        return block[self.cy, self.cx]
+
+    def candidates(self, x, y, radius):
+        if self.order is None:
+            self.sort()
+        x0 = max(int((x - radius) // self.cell_size), 0)
+        x1 = min(int((x + radius) // self.cell_size), self.cols - 1)
+        y0 = max(int((y - radius) // self.cell_size), 0)
+        y1 = min(int((y + radius) // self.cell_size), self.rows - 1)
+        parts = []
+        for cy in range(y0, y1 + 1):
+            # Cells of one row are contiguous in the sorted order
+            start = self.starts[cy * self.cols + x0]
+            end = self.starts[cy * self.cols + x1 + 1]
+            if end > start:
+                parts.append(self.order[start:end])
+        if not parts:
+            return np.empty(0, np.intp)
+        return np.concatenate(parts)
+
+    def query_radius(self, x, y, radius):
+        # Slots within radius of (x, y)
+        slots = self.candidates(x, y, radius)
+        d2 = (self.x[slots] - x) ** 2 + (self.y[slots] - y) ** 2
+        return slots[d2 <= radius * radius]
+
+    def nearest(self, x, y, k, max_radius=None, exclude=None):
+        # Up to k (distance, slot) pairs closest to (x, y), nearest first
+        if self.n == 0:
+            return []
+        radius = self.cell_size
+        full = math.hypot(self.cols, self.rows) * self.cell_size
+        if max_radius is not None:
+            full = min(full, max_radius)
+        while True:
+            radius = min(radius, full)
+            slots = self.candidates(x, y, radius)
+            if exclude is not None:
+                slots = slots[slots != exclude]
+            distance = np.hypot(self.x[slots] - x, self.y[slots] - y)
+            inside = distance <= radius
+            # Enough fish inside the circle, or nowhere left to look
+            if inside.sum() >= k or radius >= full:
+                slots = slots[inside]
+                distance = distance[inside]
+                take = np.argsort(distance, kind="stable")[:k]
+                return list(zip(distance[take].tolist(), slots[take].tolist()))
+            radius *= 2
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+
+import pygame
+
+# Scaled and flipped fish images shared by every fish on screen. A fish only
+# needs one of (species, animation frame, size, facing), and sizes are
+# rounded to SIZE_STEP pixels, so a pond full of fish needs a few hundred
+# surfaces at most; each is made the first time it is asked for and the
+# least recently used ones are dropped past max_entries.
+#
+# The source images are never modified, so one fish turning around no longer
+# flips the images of every other fish of its species.
+
+SIZE_STEP = 2
+MAX_ENTRIES = 1024
+
+
+def quantize(size, step=SIZE_STEP):
+    return max(step, int(round(size / step)) * step)
+
+
+class SpriteAtlas:
+    def __init__(self, species, default, max_entries=MAX_ENTRIES, size_step=SIZE_STEP):
+        # species: genesis -> list of animation frames at full resolution
+        self.species = species
+        self.default = default
+        self.max_entries = max_entries
+        self.size_step = size_step
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def frames(self, genesis):
+        return self.species.get(genesis) or self.species[self.default]
+
+    def get(self, genesis, frame, size, face_right=True):
+        images = self.frames(genesis)
+        frame %= len(images)
+        size = quantize(size, self.size_step)
+        key = (genesis, frame, size, face_right)
+        image = self.cache.get(key)
+        if image is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return image
+        self.misses += 1
+        image = pygame.transform.scale(images[frame], (size, size))
+        if not face_right:
+            image = pygame.transform.flip(image, True, False)
+        self.cache[key] = image
+        if len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return image
+
+    def clear(self):
+        self.cache.clear()
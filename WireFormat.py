@@ -0,0 +1,336 @@
+import struct
+import sys
+
+from FishData import FishData
+from PondData import PondData
+from PondDelta import PondDelta
+from PondSummary import PondSummary
+from Payload import Payload
+
+# Binary encoding of Payload messages. Layout of one message:
+#
+#   u8  WIRE_VERSION
+#   u8  action code (ACTIONS)
+#   u32 correlation id (Payload.id)
+#   u16 number of interned strings, then each one as u8 length + utf-8 bytes
+#   body, depending on the action (see encode_* below)
+#
+# Every string in the body (pond names, genesis) is a u16 index
+# into the string table, so a pond with hundreds of fish of the same genesis
+# only carries the name once. Fish are fixed-width FISH records.
+# Version 2: MIGRATE/BOUNCE carry a list of fish instead of exactly one
+# Version 3: correlation id in the header, ACK
+WIRE_VERSION = 3
+
+ACTIONS = {
+    "SEND": 1,
+    "DELTA": 2,
+    "MIGRATE": 3,
+    "!DISCONNECT": 4,
+    "BOUNCE": 5,
+    "HEARTBEAT": 6,
+    "HELLO": 7,
+    "ACK": 8,
+    "SUBSCRIBE": 9,
+    "SUMMARY": 10,
+}
+ACTION_NAMES = {code: name for name, code in ACTIONS.items()}
+
+NO_STRING = 0xFFFF
+
+# state and status only ever take these values, so they travel as one byte
+STATES = ("in-pond", "on-migrate")
+STATUSES = ("alive", "dead")
+STATE_CODES = {value: code for code, value in enumerate(STATES)}
+STATUS_CODES = {value: code for code, value in enumerate(STATUSES)}
+# How much of a pond a SUBSCRIBE asks for
+DETAILS = ("COUNT", "FULL")
+DETAIL_CODES = {value: code for code, value in enumerate(DETAILS)}
+
+HEADER = struct.Struct("!BBIH")
+# id, id width, parent id, parent id width (0 = no parent), state, status,
+# genesis, crowdThreshold, pheromone, pheromoneThresh, lifetime
+FISH = struct.Struct("!QBQBBBHBIBH")
+POND = struct.Struct("!HII")          # name, version, fish count
+DELTA = struct.Struct("!HIIIII")      # name, version, base, added, changed, removed
+FISH_ID = struct.Struct("!QB")
+MIGRATE = struct.Struct("!HH")        # destination, fish count
+DISCONNECT = struct.Struct("!H")      # pond name, also used by HEARTBEAT
+SUBSCRIPTION = struct.Struct("!HB")   # pond name, detail
+SUMMARY = struct.Struct("!HII")       # name, version, fish count
+U16 = struct.Struct("!H")
+U8 = struct.Struct("!B")
+STRING_REF = struct.Struct("!H")
+
+
+class WireError(Exception):
+    pass
+
+
+class StringTable:
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def intern(self, value):
+        if value is None:
+            return NO_STRING
+        idx = self.index.get(value)
+        if idx is None:
+            idx = len(self.strings)
+            if idx >= NO_STRING:
+                raise WireError("Too many distinct strings in one message")
+            self.index[value] = idx
+            self.strings.append(value)
+        return idx
+
+    def pack(self):
+        parts = []
+        for value in self.strings:
+            raw = value.encode("utf-8")
+            if len(raw) > 255:
+                raise WireError(f"String too long for the wire: {value[:20]}...")
+            parts.append(U8.pack(len(raw)))
+            parts.append(raw)
+        return b"".join(parts)
+
+
+def pack_id(fishId):
+    # Ids are digit strings; keep the width so leading zeros survive
+    if fishId is None:
+        return 0, 0
+    fishId = str(fishId)
+    if not fishId.isdigit() or len(fishId) > 20:
+        raise WireError(f"Fish id {fishId!r} is not a decimal id")
+    return int(fishId), len(fishId)
+
+
+def unpack_id(value, width):
+    if width == 0:
+        return None
+    return str(value).zfill(width)
+
+
+def pack_fish(fish, table):
+    fishId, idWidth = pack_id(fish.id)
+    parentId, parentWidth = pack_id(fish.parentId)
+    try:
+        return FISH.pack(
+            fishId, idWidth, parentId, parentWidth,
+            STATE_CODES[fish.state], STATUS_CODES[fish.status],
+            table.intern(fish.genesis), fish.crowdThreshold, fish.pheromone,
+            fish.pheromoneThresh, fish.lifetime)
+    except (KeyError, struct.error) as e:
+        raise WireError(f"Fish {fish.id} does not fit the wire format: {e}")
+
+
+def encode_pond(pond, table):
+    fishes = pond.fishes
+    parts = [POND.pack(table.intern(pond.pondName), pond.version, len(fishes))]
+    parts.extend(pack_fish(fish, table) for fish in fishes)
+    return parts
+
+
+def encode_delta(delta, table):
+    parts = [DELTA.pack(table.intern(delta.pondName), delta.version,
+                        delta.baseVersion, len(delta.added),
+                        len(delta.changed), len(delta.removed))]
+    parts.extend(pack_fish(fish, table) for fish in delta.added)
+    parts.extend(pack_fish(fish, table) for fish in delta.changed)
+    parts.extend(FISH_ID.pack(*pack_id(fishId)) for fishId in delta.removed)
+    return parts
+
+
+def encode_migrate(migration, table):
+    fishes = migration["fishes"]
+    parts = [MIGRATE.pack(table.intern(migration["destination"]), len(fishes))]
+    parts.extend(pack_fish(fish, table) for fish in fishes)
+    return parts
+
+
+def encode_disconnect(pond, table):
+    name = pond.pondName if pond is not None else None
+    return [DISCONNECT.pack(table.intern(name))]
+
+
+def encode_ack(data, table):
+    # The correlation id in the header says everything
+    return []
+
+
+def encode_subscribe(interests, table):
+    # interests: pond name -> detail
+    parts = [U16.pack(len(interests))]
+    try:
+        parts.extend(SUBSCRIPTION.pack(table.intern(name), DETAIL_CODES[detail])
+                     for name, detail in interests.items())
+    except KeyError as e:
+        raise WireError(f"Unknown subscription detail {e}")
+    return parts
+
+
+def encode_summary(summary, table):
+    return [SUMMARY.pack(table.intern(summary.pondName), summary.version,
+                         summary.count)]
+
+
+def encode_hello(codecs, table):
+    # Compression codec names, most preferred first
+    return [U8.pack(len(codecs))] + [STRING_REF.pack(table.intern(name))
+                                     for name in codecs]
+
+
+ENCODERS = {
+    "SEND": encode_pond,
+    "DELTA": encode_delta,
+    "MIGRATE": encode_migrate,
+    "!DISCONNECT": encode_disconnect,
+    "BOUNCE": encode_migrate,
+    "HEARTBEAT": encode_disconnect,
+    "HELLO": encode_hello,
+    "ACK": encode_ack,
+    "SUBSCRIBE": encode_subscribe,
+    "SUMMARY": encode_summary,
+}
+
+
+def encode(payload):
+    code = ACTIONS.get(payload.action)
+    if code is None:
+        raise WireError(f"Unknown action {payload.action!r}")
+    table = StringTable()
+    body = ENCODERS[payload.action](payload.data, table)
+    return b"".join([HEADER.pack(WIRE_VERSION, code, payload.id, len(table.strings)),
+                     table.pack()] + body)
+
+
+def with_id(data, requestId):
+    # The same encoded message under another correlation id, so the hub can
+    # forward a request without decoding and encoding it again
+    version, code, _, count = HEADER.unpack_from(data, 0)
+    out = bytearray(data)
+    HEADER.pack_into(out, 0, version, code, requestId, count)
+    return bytes(out)
+
+
+def unpack_fishes(data, offset, count, strings):
+    end = offset + count * FISH.size
+    if end > len(data):
+        raise WireError("Truncated fish records")
+    fishes = []
+    for (fishId, idWidth, parentId, parentWidth, state, status, genesis,
+         crowdThreshold, pheromone, pheromoneThresh,
+         lifetime) in FISH.iter_unpack(data[offset:end]):
+        # Skip __init__: it would draw random thresholds we overwrite anyway
+        fish = FishData.__new__(FishData)
+        fish.id = str(fishId).zfill(idWidth)
+        fish.parentId = str(parentId).zfill(parentWidth) if parentWidth else None
+        fish.state = STATES[state]
+        fish.status = STATUSES[status]
+        fish.genesis = strings[genesis]
+        fish.crowdThreshold = crowdThreshold
+        fish.pheromone = pheromone
+        fish.pheromoneThresh = pheromoneThresh
+        fish.lifetime = lifetime
+        fishes.append(fish)
+    return fishes, end
+
+
+def decode_pond(data, offset, strings):
+    name, version, count = POND.unpack_from(data, offset)
+    pond = PondData(strings[name])
+    pond.version = version
+    pond.fishes, offset = unpack_fishes(data, offset + POND.size, count, strings)
+    return pond
+
+
+def decode_delta(data, offset, strings):
+    name, version, base, added, changed, removed = DELTA.unpack_from(data, offset)
+    delta = PondDelta(strings[name], version, base)
+    offset += DELTA.size
+    delta.added, offset = unpack_fishes(data, offset, added, strings)
+    delta.changed, offset = unpack_fishes(data, offset, changed, strings)
+    end = offset + removed * FISH_ID.size
+    if end > len(data):
+        raise WireError("Truncated removed ids")
+    delta.removed = [unpack_id(value, width)
+                     for value, width in FISH_ID.iter_unpack(data[offset:end])]
+    return delta
+
+
+def decode_migrate(data, offset, strings):
+    destination, count = MIGRATE.unpack_from(data, offset)
+    fishes, offset = unpack_fishes(data, offset + MIGRATE.size, count, strings)
+    return {"destination": strings[destination], "fishes": fishes}
+
+
+def decode_disconnect(data, offset, strings):
+    (name,) = DISCONNECT.unpack_from(data, offset)
+    if strings[name] is None:
+        return None
+    return PondData(strings[name])
+
+
+def decode_ack(data, offset, strings):
+    return None
+
+
+def decode_subscribe(data, offset, strings):
+    (count,) = U16.unpack_from(data, offset)
+    offset += U16.size
+    interests = {}
+    for i in range(count):
+        name, detail = SUBSCRIPTION.unpack_from(data, offset + i * SUBSCRIPTION.size)
+        interests[strings[name]] = DETAILS[detail]
+    return interests
+
+
+def decode_summary(data, offset, strings):
+    name, version, count = SUMMARY.unpack_from(data, offset)
+    return PondSummary(strings[name], version, count)
+
+
+def decode_hello(data, offset, strings):
+    (count,) = U8.unpack_from(data, offset)
+    offset += U8.size
+    return [strings[STRING_REF.unpack_from(data, offset + i * STRING_REF.size)[0]]
+            for i in range(count)]
+
+
+DECODERS = {
+    "SEND": decode_pond,
+    "DELTA": decode_delta,
+    "MIGRATE": decode_migrate,
+    "!DISCONNECT": decode_disconnect,
+    "BOUNCE": decode_migrate,
+    "HEARTBEAT": decode_disconnect,
+    "HELLO": decode_hello,
+    "ACK": decode_ack,
+    "SUBSCRIBE": decode_subscribe,
+    "SUMMARY": decode_summary,
+}
+
+
+def decode(data):
+    try:
+        version, code, requestId, count = HEADER.unpack_from(data, 0)
+        if version != WIRE_VERSION:
+            raise WireError(f"Unsupported wire version {version}")
+        action = ACTION_NAMES.get(code)
+        if action is None:
+            raise WireError(f"Unknown action code {code}")
+        offset = HEADER.size
+        strings = {NO_STRING: None}
+        for i in range(count):
+            (length,) = U8.unpack_from(data, offset)
+            offset += 1
+            # Interned, so every fish of a genesis shares one string
+            strings[i] = sys.intern(data[offset:offset + length].decode("utf-8"))
+            offset += length
+        payload = Payload()
+        payload.action = action
+        payload.id = requestId
+        payload.data = DECODERS[action](data, offset, strings)
+        return payload
+    except (struct.error, KeyError, IndexError, UnicodeDecodeError) as e:
+        raise WireError(f"Malformed message: {e}")
@@ -0,0 +1,40 @@
+import sys
+import timeit
+
+import Compression
+import WireFormat
+from benchmark_wire import make_payload
+
+# CPU/bandwidth tradeoff of each available codec on encoded SEND payloads.
+# python benchmark_compression.py [fish counts...]
+
+POND_SIZES = [10, 50, 100, 500, 1000, 5000]
+
+
+def best_time(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def run(sizes):
+    print(f"Compression threshold: {Compression.COMPRESS_THRESHOLD} bytes")
+    print(f"{'fish':>6} {'codec':>6} {'raw B':>9} {'packed B':>9} {'ratio':>6} "
+          f"{'compress':>10} {'decompress':>11} {'MB/s in':>8}")
+    for size in sizes:
+        data = WireFormat.encode(make_payload(size))
+        number = max(1, 20000 // (size + 1))
+        for name in Compression.PREFERENCE:
+            codec = Compression.codec_id(name)
+            flags, packed = Compression.compress(data, codec)
+            compress_time = best_time(lambda: Compression.compress(data, codec), number)
+            decompress_time = best_time(
+                lambda: Compression.decompress(flags, packed), number)
+            note = "" if flags else "  (sent uncompressed)"
+            print(f"{size:>6} {name:>6} {len(data):>9} {len(packed):>9} "
+                  f"{len(data) / len(packed):>5.1f}x "
+                  f"{compress_time * 1e6:>8.1f}us {decompress_time * 1e6:>9.1f}us "
+                  f"{len(data) / compress_time / 1e6:>8.1f}{note}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or POND_SIZES
+    run(sizes)
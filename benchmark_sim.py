@@ -0,0 +1,56 @@
+import sys
+import time
+
+import numpy as np
+
+from FishData import FishData
+from FishEngine import FishEngine
+from PondData import PondData
+from Simulation import PondSimulation, TPS
+
+# Ticks per second of the pure-Python PondSimulation against the vectorized
+# FishEngine for one pond.
+# python benchmark_sim.py [fish counts...]
+
+POND_SIZES = [100, 1000, 10000, 100000]
+TICKS = 100
+PYTHON_LIMIT = 2000      # PondSimulation gets too slow to wait for past this
+
+
+def make_pond(fish_count):
+    pond = PondData("pla")
+    for i in range(fish_count):
+        fish = FishData("pla")
+        fish.id = str(i)
+        fish.crowdThreshold = fish_count + 1    # nobody dies of crowding
+        pond.addFish(fish)
+    return pond
+
+
+def time_ticks(sim, ticks):
+    sim.step()     # picks up the starting fish
+    start = time.perf_counter()
+    sim.run(ticks)
+    return (time.perf_counter() - start) / ticks
+
+
+def run(sizes):
+    print(f"{'fish':>7} {'python ms':>10} {'numpy ms':>9} {'speedup':>8} {'numpy TPS':>10}")
+    for size in sizes:
+        engine_time = time_ticks(FishEngine(make_pond(size),
+                                            rng=np.random.default_rng(0)), TICKS)
+        if size <= PYTHON_LIMIT:
+            python_time = time_ticks(PondSimulation(make_pond(size)), TICKS)
+            python_ms = f"{python_time * 1000:>10.2f}"
+            speedup = f"{python_time / engine_time:>7.1f}x"
+        else:
+            python_ms = f"{'-':>10}"
+            speedup = f"{'-':>8}"
+        print(f"{size:>7} {python_ms} {engine_time * 1000:>9.2f} {speedup} "
+              f"{1 / engine_time:>10.0f}")
+    print(f"(real time is {TPS} ticks per second)")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or POND_SIZES
+    run(sizes)
@@ -0,0 +1,54 @@
+import pickle
+import sys
+import timeit
+
+import WireFormat
+from FishData import FishData
+from PondData import PondData
+from Payload import Payload
+
+# Compares WireFormat against pickle for SEND payloads of different sizes.
+# python benchmark_wire.py [fish counts...]
+
+POND_SIZES = [10, 100, 1000, 10000]
+
+
+def make_payload(fish_count):
+    pond = PondData("sick-salmon")
+    for i in range(fish_count):
+        pond.addFish(FishData("sick-salmon", "123456"))
+    payload = Payload()
+    payload.action = "SEND"
+    payload.data = pond
+    return payload
+
+
+def best_time(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def run(sizes):
+    print(f"{'fish':>7} {'pickle B':>10} {'wire B':>10} {'ratio':>6} "
+          f"{'pickle enc':>11} {'wire enc':>11} {'pickle dec':>11} "
+          f"{'wire dec':>11} {'dec ratio':>9}")
+    for size in sizes:
+        payload = make_payload(size)
+        pickled = pickle.dumps(payload)
+        wired = WireFormat.encode(payload)
+        number = max(1, 20000 // (size + 1))
+
+        pickle_enc = best_time(lambda: pickle.dumps(payload), number)
+        wire_enc = best_time(lambda: WireFormat.encode(payload), number)
+        pickle_dec = best_time(lambda: pickle.loads(pickled), number)
+        wire_dec = best_time(lambda: WireFormat.decode(wired), number)
+
+        print(f"{size:>7} {len(pickled):>10} {len(wired):>10} "
+              f"{len(pickled) / len(wired):>5.1f}x "
+              f"{pickle_enc * 1e6:>9.1f}us {wire_enc * 1e6:>9.1f}us "
+              f"{pickle_dec * 1e6:>9.1f}us {wire_dec * 1e6:>9.1f}us "
+              f"{pickle_dec / wire_dec:>8.2f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or POND_SIZES
+    run(sizes)
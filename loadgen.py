@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import server
+from AsyncClient import AsyncClient
+from Client import Client, SEND_INTERVAL
+from FishData import FishData
+from PondData import PondData
+
+# Headless load generator for the vivisystem hub. Runs many synthetic ponds
+# in one process on the real Client/PondData/FishData code (no pygame) and
+# reports what the hub sustained:
+#
+#   python loadgen.py --ponds 50 --fish 200 --duration 20 --spawn-server asyncio
+#
+# --client asyncio runs the ponds as AsyncClients on one event loop instead
+# of a few threads each. --subscribe count makes every pond subscribe to the
+# others at COUNT detail, as a census view would.
+#
+# Broadcast latency is measured from the moment a pond sends a version of
+# itself to the moment each other pond receives it, which works because all
+# ponds live in this process and share one clock.
+
+sent_at = {}          # (pondName, version) -> perf_counter() at send time
+stats_lock = threading.Lock()
+
+
+class Stats:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.migrations = 0
+        self.latencies = []
+
+    def percentile(self, p):
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+stats = Stats()
+
+
+class LoadMixin:
+    # The synthetic pond, on top of either client
+    def __init__(self, pond, addr, pond_names, args):
+        super().__init__(pond, addr)
+        self.pond_names = pond_names
+        self.args = args
+        self.rng = random.Random(pond.pondName)
+
+    def handle_msg(self, msg):
+        now = time.perf_counter()
+        key = None
+        if msg.action in ("SEND", "DELTA", "SUMMARY"):
+            key = (msg.data.pondName, msg.data.version)
+        with stats_lock:
+            stats.received += 1
+            start = sent_at.get(key)
+            if start is not None and key[0] != self.pond.pondName:
+                stats.latencies.append(now - start)
+        return super().handle_msg(msg)
+
+    def churn(self):
+        # A few births and deaths so deltas are not empty
+        for i in range(self.args.churn):
+            if len(self.pond):
+                ids = list(self.pond.index)
+                self.pond.removeFishById(ids[self.rng.randrange(len(ids))])
+            self.pond.addFish(FishData(self.pond.pondName))
+
+    def sent(self):
+        with stats_lock:
+            sent_at[(self.pond.pondName, self.sent_version)] = time.perf_counter()
+            stats.sent += 1
+
+    def maybe_migrate(self):
+        if self.rng.random() < self.args.migrate_rate * self.args.interval:
+            destination = self.rng.choice(self.pond_names)
+            self.migrate_fish(FishData(self.pond.pondName), destination)
+            with stats_lock:
+                stats.migrations += 1
+
+
+class LoadClient(LoadMixin, Client):
+    # Replaces Client.send_pond, so it keeps up the heartbeat too
+    def run(self, stop):
+        next_heartbeat = time.monotonic() + SEND_INTERVAL
+        while not stop.is_set():
+            time.sleep(self.args.interval)
+            self.churn()
+            with self.sync_lock:
+                if self.sync_pond_locked(False):
+                    self.sent()
+            if time.monotonic() >= next_heartbeat:
+                self.heartbeat()
+                next_heartbeat += SEND_INTERVAL
+            self.maybe_migrate()
+
+
+class AsyncLoadClient(LoadMixin, AsyncClient):
+    async def run_async(self, stop):
+        while not stop.is_set():
+            await asyncio.sleep(self.args.interval)
+            self.churn()
+            if await self.sync_pond_async():
+                self.sent()
+            self.maybe_migrate()
+
+
+def spawn_server(mode, port):
+    command = [sys.executable, os.path.join(os.path.dirname(__file__) or ".", "server.py"),
+               "--port", str(port)]
+    if mode == "asyncio":
+        command.append("--asyncio")
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    time.sleep(1)
+    return process
+
+
+def process_cpu(pid):
+    # utime + stime of another process in seconds (Linux only, else None)
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for the vivisystem hub")
+    parser.add_argument("--host", default=server.IP)
+    parser.add_argument("--port", type=int, default=server.PORT)
+    parser.add_argument("--ponds", type=int, default=20)
+    parser.add_argument("--fish", type=int, default=100)
+    parser.add_argument("--interval", type=float, default=0.5,
+                        help="seconds between pond syncs")
+    parser.add_argument("--churn", type=int, default=2,
+                        help="fish born and killed per pond per interval")
+    parser.add_argument("--migrate-rate", type=float, default=1.0,
+                        help="migrations per pond per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--spawn-server", choices=["threaded", "asyncio"],
+                        help="start server.py as a child process")
+    parser.add_argument("--client", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--subscribe", choices=["full", "count"], default="full",
+                        help="what each pond asks the hub for about the others")
+    args = parser.parse_args()
+
+    hub = spawn_server(args.spawn_server, args.port) if args.spawn_server else None
+    addr = (args.host, args.port)
+    pond_names = [f"pond-{i}" for i in range(args.ponds)]
+    stop = threading.Event()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        clients = []
+        for name in pond_names:
+            pond = PondData(name)
+            for i in range(args.fish):
+                pond.addFish(FishData(name))
+            if args.client == "asyncio":
+                client = AsyncLoadClient(pond, addr, pond_names, args).start()
+            else:
+                client = LoadClient(pond, addr, pond_names, args)
+                threading.Thread(target=client.get_msg, daemon=True).start()
+            if args.subscribe == "count":
+                client.subscribe({other: "COUNT" for other in pond_names}).result()
+            client.sync_pond(keyframe=True)
+            clients.append(client)
+
+        cpu_start = time.process_time()
+        hub_cpu_start = process_cpu(hub.pid) if hub is not None else None
+        wall_start = time.perf_counter()
+        if args.client == "asyncio":
+            workers = [client.loop.submit(client.run_async(stop)) for client in clients]
+        else:
+            workers = [threading.Thread(target=client.run, args=(stop,), daemon=True)
+                       for client in clients]
+            for worker in workers:
+                worker.start()
+        time.sleep(args.duration)
+        stop.set()
+        for worker in workers:
+            if args.client == "asyncio":
+                worker.result()
+            else:
+                worker.join()
+        time.sleep(args.interval)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        hub_cpu_end = process_cpu(hub.pid) if hub is not None else None
+
+        for client in clients:
+            client.disconnect()
+        time.sleep(0.5)
+
+    bytes_sent = sum(client.stream.bytes_sent for client in clients)
+    bytes_received = sum(client.stream.bytes_received for client in clients)
+    sent = stats.sent + stats.migrations
+    reconnects = sum(client.reconnects for client in clients)
+
+    print(f"ponds={args.ponds} fish/pond={args.fish} interval={args.interval}s "
+          f"duration={wall:.1f}s")
+    print(f"messages sent      {sent:>10}  ({sent / wall:.0f}/s)")
+    print(f"messages received  {stats.received:>10}  ({stats.received / wall:.0f}/s)")
+    print(f"migrations         {stats.migrations:>10}")
+    print(f"reconnects         {reconnects:>10}")
+    print(f"broadcast latency  p50 {stats.percentile(50) * 1000:.2f} ms  "
+          f"p99 {stats.percentile(99) * 1000:.2f} ms")
+    print(f"bytes on the wire  sent {bytes_sent}  received {bytes_received}")
+    if stats.received:
+        print(f"client CPU         {cpu * 1e6 / stats.received:.1f} us per received message")
+
+    if hub is not None:
+        hub.terminate()
+        hub.wait()
+        if hub_cpu_start is not None and hub_cpu_end is not None:
+            hub_cpu = hub_cpu_end - hub_cpu_start
+        else:
+            # Includes the server's start-up and shutdown
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            hub_cpu = usage.ru_utime + usage.ru_stime
+        if sent:
+            print(f"server CPU         {hub_cpu:.2f} s total, "
+                  f"{hub_cpu * 1e6 / sent:.1f} us per inbound message, "
+                  f"{hub_cpu * 1e6 / max(stats.received, 1):.1f} us per delivered message")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,11 +11,18 @@ import matplotlib.pyplot as plt
 import warnings
 # import menu
 import random                       # meny.py should be in the folder
+import sys
 
 from FishData import FishData
 from PondData import PondData
-from Client import Client
+from AsyncClient import AsyncClient
 from Menu import Menu
+from Simulation import SPEED_FISH, MAX_FISH, TPS, MAX_SIZE
+from Simulation import POND_WIDTH as SCREEN_WIDTH, POND_HEIGHT as SCREEN_HEIGHT
+from FishEngine import FishEngine
+from MigrationDispatcher import AsyncMigrationDispatcher
+import SessionLog
+from SpriteAtlas import SpriteAtlas
 from functools import partial
 
 FPS = 30
@@ -26,15 +33,8 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 number_of_colors = 8
 
 GAME_TITLE = 'The Aquarium'
-SPEED_FISH = 5            # speed of fish    # starting number of fish
-MAX_FISH = 100            # max number of fishs
-TPS = 30
-MAX_SIZE = 48
 MAX_DURATION = 1*60*TPS    # number of seconds
 
-SCREEN_WIDTH = 800
-SCREEN_HEIGHT = 600
-
 # Define some colors
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -42,30 +42,88 @@ RED = (255, 0, 0)
 GREY = (169, 169, 169)
 GREEN = (0, 100, 0)
 
+# Draw order of the sprite layers
+FISH_LAYER = 0
+MAXBAR_LAYER = 1
+BAR_LAYER = 2
+HUD_LAYER = 3
+
+# Census of the other ponds shown in the corner: (pond name, label)
+HUD_PONDS = [("pla", "PLA"), ("sick-salmon", "SICK-SALMON"),
+             ("peem", "PEEM"), ("dang", "DANG")]
+
+# The pond is simulated at TPS ticks per second whatever the frame rate, and
+# frames are drawn as fast as MAX_FPS allows. After a slow frame the loop runs
+# the ticks it missed, but at most MAX_CATCH_UP per frame; anything beyond that
+# is dropped so that one long stall does not turn into a burst of ticks.
+MAX_FPS = 120
+MAX_CATCH_UP = 5
+
+
+class FixedTimestep:
+
+    def __init__(self, rate=TPS, max_steps=MAX_CATCH_UP, clock=time.perf_counter):
+        self.interval = 1.0 / rate
+        self.max_steps = max_steps
+        self.clock = clock
+        self.last = clock()
+        self.accumulator = 0.0
+        self.dropped = 0
+
+    def ticks(self):
+        # Number of simulation ticks to run now
+        now = self.clock()
+        self.accumulator += now - self.last
+        self.last = now
+        due = int(self.accumulator / self.interval)
+        self.accumulator -= due * self.interval
+        if due > self.max_steps:
+            self.dropped += due - self.max_steps
+            due = self.max_steps
+        return due
+
+    def alpha(self):
+        # How far the next frame is between the last tick and the next one
+        return min(self.accumulator / self.interval, 1.0)
+
+# Sprite images per species, filled by load_assets() so that importing this
+# module does not need a display or the asset files
 pla = []
-pla.append(pygame.image.load("./asset/pla1.png"))
-pla.append(pygame.image.load("./asset/pla2.png"))
-pla.append(pygame.image.load("./asset/pla3.png"))
-pla.append(pygame.image.load("./asset/pla4.png"))
 sicksalmon = []
-sicksalmon.append(pygame.image.load("./asset/ss1.png"))
-sicksalmon.append(pygame.image.load("./asset/ss2.png"))
-sicksalmon.append(pygame.image.load("./asset/ss3.png"))
-sicksalmon.append(pygame.image.load("./asset/ss4.png"))
 peem = []
-peem.append(pygame.image.load("./asset/p1.png"))
-peem.append(pygame.image.load("./asset/p2.png"))
-peem.append(pygame.image.load("./asset/p3.png"))
-peem.append(pygame.image.load("./asset/p4.png"))
-
 dang = []
-dang.append(pygame.image.load("./asset/dang.png"))
+atlas = None
+
+
+def load_assets():
+    global atlas
+    if pla:
+        return
+    pla.append(pygame.image.load("./asset/pla1.png"))
+    pla.append(pygame.image.load("./asset/pla2.png"))
+    pla.append(pygame.image.load("./asset/pla3.png"))
+    pla.append(pygame.image.load("./asset/pla4.png"))
+    sicksalmon.append(pygame.image.load("./asset/ss1.png"))
+    sicksalmon.append(pygame.image.load("./asset/ss2.png"))
+    sicksalmon.append(pygame.image.load("./asset/ss3.png"))
+    sicksalmon.append(pygame.image.load("./asset/ss4.png"))
+    peem.append(pygame.image.load("./asset/p1.png"))
+    peem.append(pygame.image.load("./asset/p2.png"))
+    peem.append(pygame.image.load("./asset/p3.png"))
+    peem.append(pygame.image.load("./asset/p4.png"))
+    dang.append(pygame.image.load("./asset/dang.png"))
+    atlas = SpriteAtlas({'pla': pla, 'sick-salmon': sicksalmon, 'peem': peem},
+                        default='pla')
+
 
 # Define the objects needed for the simulation
-class Block(pygame.sprite.Sprite):
+# Sprites are DirtySprites drawn by a LayeredDirty group, which only redraws
+# the ones marked dirty. Anything that moves or changes its image sets
+# self.dirty = 1.
+class Block(pygame.sprite.DirtySprite):
 
     def __init__(self, width, height, fill, color=BLACK):
-        pygame.sprite.Sprite.__init__(self)
+        pygame.sprite.DirtySprite.__init__(self)
         self.color = color
         self.image = pygame.Surface([width, height])
         self.fill = fill
@@ -77,6 +135,13 @@ class Block(pygame.sprite.Sprite):
         self.image = pygame.Surface([width, height])
         if(self.fill):
             self.image.fill(self.color)
+        self.rect.size = (width, height)
+        self.dirty = 1
+
+    def moveTo(self, x, y):
+        if (x, y) != self.rect.topleft:
+            self.rect.topleft = (x, y)
+            self.dirty = 1
 
 
 class Bar(Block):
@@ -89,9 +154,11 @@ class Bar(Block):
         self.rect.x = x
         self.rect.y = y
 
-    def update(self):
-        self.width += (MAX_SIZE / self.lifetime)
-        self.changeSize(self.width, self.height)
+    def update(self, age):
+        width = int(age * MAX_SIZE / self.lifetime)
+        if width != self.width:
+            self.width = width
+            self.changeSize(self.width, self.height)
 
 
 class MaxBar(Block):
@@ -104,125 +171,49 @@ class MaxBar(Block):
         self.rect.y = y
 
     def update(self, currentSize):
-        self.width = currentSize
-        self.changeSize(self.width, self.height)
+        width = int(currentSize)
+        if width != self.width:
+            self.width = width
+            self.changeSize(self.width, self.height)
 
 
 class Fish(Block):
-
-    def __init__(self, fishData, imgs=pla):
-        self.fishData = fishData
-        self.width = 6
-        self.height = 6
-        self.lifetime = fishData.lifetime*10
-        self.face_right = True
-        self.imgs = imgs
-        self.current_img = self.imgs[0]
-        self.frame = 0
+    # Pygame view of one simulated fish (a Simulation.FishBody)
+
+    def __init__(self, body):
+        self.body = body
+        self.fishData = body.fishData
+        self.width = body.size
+        self.height = body.size
+        self.lifetime = body.lifetime
         Block.__init__(self, self.width, self.height, False)
-        self.image = self.current_img
-        self.image = pygame.transform.scale(
-            self.image, (self.width, self.height))
-        self.rect.x = np.random.randint(0, SCREEN_WIDTH)
-        self.rect.y = np.random.randint(0, SCREEN_HEIGHT)
+        self.image = atlas.get(self.fishData.genesis, 0, body.size)
+        self.rect.x = body.x
+        self.rect.y = body.y
         self.bar = Bar(self.rect.x, self.rect.y - 12, self.lifetime)
         self.maxBar = MaxBar(self.rect.x, self.rect.y - 12)
-        self.angle = np.arctan2(np.random.randint(-10, 11),
-                                np.random.randint(-10, 11))
-        self.age = 0
-        self.speed = SPEED_FISH
-        self.growth_rate = MAX_SIZE / (self.lifetime / 2)
 
-    def changeSize(self, width, height):
-        self.image = self.current_img
-        self.image = pygame.transform.scale(self.image, (width, height))
-        if not self.face_right:
-            self.image = pygame.transform.flip(self.image, True, False)
-
-    def procreate(self, same_species_list, bar_list, maxBar_list):
-
-        if (self.fishData.pheromone >= (self.fishData.pheromoneThresh * 10)):
-            genesis =  self.fishData.genesis
-            baby = FishData(genesis, self.fishData.id)
-            if(genesis == 'sick-salmon'):
-                elem = Fish(baby,sicksalmon)
-            elif(genesis == 'peem'):
-                elem = Fish(baby,peem)
-            elif(genesis == 'dang'):
-                elem = Fish(baby)
-            else:
-                elem = Fish(baby)
-            
-            elem.rect.x = self.rect.x
-            elem.rect.y = self.rect.y
-            elem.bar.rect.x = self.rect.x
-            elem.bar.rect.y = self.rect.y - 12
-            elem.maxBar.rect.x = self.rect.x
-            elem.maxBar.rect.y = self.rect.y - 12
-            c.pond.fishes.append(baby)
-            same_species_list.add(elem)
-            bar_list.add(elem.bar)
-            maxBar_list.add(elem.maxBar)
-            self.fishData.pheromone = 0
-
-    def stay_on_screen(self):
-        if self.rect.right > SCREEN_WIDTH or self.rect.x < 0:
-            self.angle = np.pi - self.angle
-
-        if self.rect.bottom > SCREEN_HEIGHT or self.rect.y < 0:
-            self.angle = -self.angle
-
-    def flip(self):
-        for i in range(len(self.imgs)):
-            self.imgs[i] = pygame.transform.flip(self.imgs[i], True, False)
-
-    def move(self):
-        face = int(self.speed * np.cos(self.angle))
-        if(face < 0 and self.face_right):
-            print("turn left!")
-            self.flip()
-            self.face_right = False
-        elif(face >= 0 and not self.face_right):
-            print("turn right!")
-            self.flip()
-            self.face_right = True
-        # elif(face >= 0 and not self.face_right):
-        #     self.image = pygame.transform.flip(self.image, True, False)
-        self.rect.x += face
-        self.rect.y += int(self.speed * np.sin(self.angle))
-        self.bar.rect.x += face
-        self.bar.rect.y += int(self.speed * np.sin(self.angle))
-        self.maxBar.rect.x += face
-        self.maxBar.rect.y += int(self.speed * np.sin(self.angle))
-
-    def update(self, same_species_list, bar_list, maxBar_list):
-        self.move()
-        self.frame += 1
-        if(self.frame >= len(self.imgs)):
-            self.frame = 0
-        self.image = self.imgs[self.frame]
-        self.current_img = self.image
-        self.stay_on_screen()
-        self.age += 1
-        self.fishData.pheromone += 1
-        self.bar.update()
-        # self.procreate(same_species_list, bar_list, maxBar_list)
-        if(self.age <= (self.lifetime / 2) and self.width < MAX_SIZE):
-            self.width += self.growth_rate
-            self.height += self.growth_rate
-            self.changeSize(self.width, self.height)
+    def update(self, alpha=1.0):
+        body = self.body
+        x, y = body.position(alpha)
+        self.moveTo(x, y)
+        self.bar.moveTo(x, y - 12)
+        self.maxBar.moveTo(x, y - 12)
+        self.width = body.size
+        self.height = body.size
+        image = atlas.get(self.fishData.genesis, body.frame,
+                          body.size, body.face_right)
+        if image is not self.image:
+            self.image = image
+            self.rect.size = image.get_size()
+            self.dirty = 1
+        self.bar.update(body.age)
         self.maxBar.update(self.width)
-        if self.age >= self.lifetime:
-            self.fishData.status = 'dead'
-        if len(c.pond.fishes) >= self.fishData.crowdThreshold:
-            self.fishData.status = 'dead'
-        if self.age == self.lifetime//2 and random.randint(0, 100) > 80:
-            group_names = ['peem', 'sick-salmon', "dang"]
-            rand = random.randint(0, len(group_names)-1)
-            migrate_handler = threading.Thread(
-                target=c.migrate_fish, args=[self.fishData, group_names[rand]])
-            migrate_handler.start()
-            self.fishData.state = 'on-migrate'
+
+    def kill(self):
+        Block.kill(self)
+        self.bar.kill()
+        self.maxBar.kill()
 
 
 class Background(pygame.sprite.Sprite):
@@ -233,23 +224,30 @@ class Background(pygame.sprite.Sprite):
         self.rect.left, self.rect.top = [0, 0]
 
 
-class TextDraw:
+class HudText(pygame.sprite.DirtySprite):
+    # Line of HUD text, only rendered again when the text changes
 
-    def __init__(self, text, font, color=BLACK, x=0, y=0):
-
-        self.text = text
+    def __init__(self, font, color=BLACK, x=0, y=0):
+        pygame.sprite.DirtySprite.__init__(self)
         self.font = font
         self.color = color
-        self.x = x
-        self.y = y
-
-    def update(self, x, y):
-        self.rect.x = x
-        self.rect.y = y
-
-    def draw(self, screen):
-        self.rect = self.font.render(self.text, True, self.color)
-        screen.blit(self.rect, (self.x, self.y))
+        self.text = None
+        self.image = pygame.Surface([0, 0])
+        self.rect = self.image.get_rect(topleft=(x, y))
+        self.visible = 0
+
+    def setText(self, text):
+        if text is None:
+            if self.visible:
+                self.visible = 0
+                self.dirty = 1
+            return
+        if text != self.text or not self.visible:
+            self.text = text
+            self.image = self.font.render(text, True, self.color)
+            self.rect.size = self.image.get_size()
+            self.visible = 1
+            self.dirty = 1
 
 
 # Initialize PyGame
@@ -258,13 +256,45 @@ if __name__ == "__main__":
     pygame.init()
     pygame.display.set_caption(GAME_TITLE)
     screen = pygame.display.set_mode([SCREEN_WIDTH, SCREEN_HEIGHT])
+    load_assets()
 
     # Launches an introductory menu
     # menu.launch(screen)    
 
     fish_list = pygame.sprite.Group()
-    bar_list = pygame.sprite.Group()
-    maxBar_list = pygame.sprite.Group()
+    sprites = pygame.sprite.LayeredDirty()
+
+    # Static layers: the background is loaded once and only used to paint
+    # over the places sprites moved away from
+    BackGround = Background('./asset/aqua.jpg')
+    backdrop = pygame.Surface(screen.get_size()).convert()
+    backdrop.fill(WHITE)
+    backdrop.blit(BackGround.image, BackGround.rect)
+    sprites.clear(screen, backdrop)
+    screen.blit(backdrop, (0, 0))
+    pygame.display.flip()
+
+    font = pygame.font.Font(None, 24)
+    hud = []
+    for i, (pond_name, label) in enumerate(HUD_PONDS):
+        line = HudText(font, "black", SCREEN_WIDTH-350, 10 + 20*i)
+        hud.append((pond_name, label, line))
+        sprites.add(line, layer=HUD_LAYER)
+
+    # --seed N makes the pond simulation deterministic; --record FILE also
+    # logs what the network puts in the pond, so that replay.py can re-run
+    # the session headless
+    seed = None
+    record = None
+    if "--seed" in sys.argv:
+        seed = int(sys.argv[sys.argv.index("--seed") + 1])
+    if "--record" in sys.argv:
+        record = sys.argv[sys.argv.index("--record") + 1]
+        if seed is None:
+            seed = int(time.time())
+    if seed is not None:
+        np.random.seed(seed)
+        random.seed(seed)
 
     # Client
     # fish_list = []
@@ -274,11 +304,14 @@ if __name__ == "__main__":
     f2 = FishData("pla", "123456")
     MY_POND.addFish(f1)
     # MY_POND.addFish(f2)
-    c = Client(MY_POND)
-    msg_handler = threading.Thread(target=c.get_msg)
-    msg_handler.start()
-    send_handler = threading.Thread(target=c.send_pond)
-    send_handler.start()
+    # Reads, periodic sends and migrations all run on the client event loop
+    # --shards N when the hub is shardserver.py sharded by port
+    shards = None
+    if "--shards" in sys.argv:
+        shards = int(sys.argv[sys.argv.index("--shards") + 1])
+    c = AsyncClient(MY_POND, shards=shards).start()
+    # The HUD only shows how many fish the other ponds have
+    c.subscribe({pond_name: "COUNT" for pond_name, label in HUD_PONDS})
     # f1 = FishData("Sick Salmon", "123456")
     # f2 = FishData("Fish2", "123456")
     # MY_POND.addFish(f1)
@@ -298,11 +331,24 @@ if __name__ == "__main__":
     #     bar_list.add(fish.bar)
     #     maxBar_list.add(fish.maxBar)
 
-    for i in c.pond.fishes:
-        fish = Fish(i)
+    migrations = AsyncMigrationDispatcher(c)
+    recorder = None
+    if seed is None:
+        sim = FishEngine(c.pond, on_migrate=migrations.add, state=c.state)
+    else:
+        if record is not None:
+            recorder = SessionLog.Recorder(record, seed, c.pond.pondName)
+        sim = SessionLog.make_simulation(c.pond, seed, recorder=recorder,
+                                         on_migrate=migrations.add, state=c.state)
+    views = {}
+
+    def show_fish(body):
+        fish = Fish(body)
+        views[body.fishData.id] = fish
         fish_list.add(fish)
-        bar_list.add(fish.bar)
-        maxBar_list.add(fish.maxBar)
+        sprites.add(fish, layer=FISH_LAYER)
+        sprites.add(fish.maxBar, layer=MAXBAR_LAYER)
+        sprites.add(fish.bar, layer=BAR_LAYER)
 
     stage = 1
     dt = []
@@ -315,11 +361,6 @@ if __name__ == "__main__":
     running = True
     clock = pygame.time.Clock()
 
-    ourPondFishList = c.pond.fishes
-    temp_fish_list = pygame.sprite.Group()
-    temp_bar_list = pygame.sprite.Group()
-    temp_maxBar_list = pygame.sprite.Group()
-
     def openMenu():
         Menu.paint_background(screen)
         menu = Menu.make_long_menu()
@@ -331,69 +372,17 @@ if __name__ == "__main__":
             fps_limit=FPS
         )
 
-    def openGame():
-        if(len(c.pond.fishes) > len(fish_list)):
-            fish_diff = len(c.pond.fishes)-(len(fish_list))
-            new_list = c.pond.fishes[len(fish_list):len(c.pond.fishes)]
-            for fish in new_list:
-                if(fish.fishData.genesis == "peem"):
-                    sfish = Fish(fish, peem)
-                elif(fish.fishData.genesis == "sick-salmon"):
-                    sfish = Fish(fish, sicksalmon)
-                else:
-                    sfish = Fish(fish)
-                fish_list.add(sfish)
-                bar_list.add(sfish.bar)
-                maxBar_list.add(sfish.maxBar)
-
-        for fish in fish_list:
-            if fish.fishData.status == "dead" or fish.fishData.state == "on-migrate":
-                c.pond.fishes.remove(fish.fishData)
-                fish.kill()
-                fish.bar.kill()
-                fish.maxBar.kill()
-
-        ourPondFishList = c.pond.fishes
-
-        BackGround = Background('./asset/aqua.jpg')
-        screen.fill(WHITE)
-        screen.blit(BackGround.image, BackGround.rect)
-
-        for fish in fish_list:
-            fish.update(fish_list, bar_list, maxBar_list)
-
-        font = pygame.font.Font(None, 24)
-        TextDraw('Fish : ' + str(len(fish_list)) + '  ',
-                 font, "black", SCREEN_WIDTH-70, 10).draw(screen)
-
-        fish_list.draw(screen)
-        maxBar_list.draw(screen)
-        bar_list.draw(screen)
-
-        pygame.display.flip()
-        clock.tick(TPS)
-
+    timestep = FixedTimestep()
     while running:
-        if(len(c.pond.fishes) > len(fish_list)):
-            fish_diff = len(c.pond.fishes)-(len(fish_list))
-            new_list = c.pond.fishes[len(fish_list):len(c.pond.fishes)]
-            for fish in new_list:
-                if(fish.genesis == "peem"):
-                    sfish = Fish(fish, peem)
-                elif(fish.genesis == "sick-salmon"):
-                    sfish = Fish(fish, sicksalmon)
-                else:
-                    sfish = Fish(fish)
-                fish_list.add(sfish)
-                bar_list.add(sfish.bar)
-                maxBar_list.add(sfish.maxBar)
-
-        for fish in fish_list:
-            if fish.fishData.status == "dead" or fish.fishData.state == "on-migrate":
-                c.pond.fishes.remove(fish.fishData)
-                fish.kill()
-                fish.bar.kill()
-                fish.maxBar.kill()
+        for tick in range(timestep.ticks()):
+            born, gone = sim.step()
+            migrations.flush()
+            for body in born:
+                show_fish(body)
+            for body in gone:
+                fish = views.pop(body.fishData.id, None)
+                if fish is not None:
+                    fish.kill()
 
         # menu = Menu.make_long_menu()
         # menu.mainloop(
@@ -402,68 +391,37 @@ if __name__ == "__main__":
         #     fps_limit=FPS
         # )
 
-        # check = any( item in c.pond.fishes for item in fish_list)
-        # for fish in c.pond.fishes:
-        #     createdFish = Fish(fish)
-        #     temp_fish_list.add(createdFish)
-        #     temp_bar_list.add(createdFish.bar)
-        #     temp_maxBar_list.add(createdFish.maxBar)
-
-        # fish_list = temp_fish_list
-        # bar_list = temp_bar_list
-        # maxBar_list = temp_maxBar_list
-        # temp_fish_list = pygame.sprite.Group()
-        # temp_bar_list = pygame.sprite.Group()
-        # temp_maxBar_list = pygame.sprite.Group()
-
-        ourPondFishList = c.pond.fishes
         for event in pygame.event.get():
             if event.type == pygame.QUIT or (
                     event.type == pygame.KEYDOWN and event.key == pygame.K_q):
                 running = False
             if event.type == pygame.KEYDOWN:
+                if recorder is not None:
+                    recorder.close()
+                migrations.close()
                 c.disconnect()
                 pygame.display.quit()
                 pygame.quit()
             # if event.type == pygame.KEYUP:
             #     openGame()
 
-        BackGround = Background('./asset/aqua.jpg')
-        screen.fill(WHITE)
-        screen.blit(BackGround.image, BackGround.rect)
-
+        alpha = timestep.alpha()
         for fish in fish_list:
-            fish.update(fish_list, bar_list, maxBar_list)
-
-        font = pygame.font.Font(None, 24)
-        # TextDraw('Fish : ' + str(len(fish_list)) + '  ', font,
-        #              "black", SCREEN_WIDTH-70, 10*i).draw(screen)
-
-        # idx = 1
-        # print(pond_name, '\t', len(pond.fishes))
-        if "pla" in c.other_ponds:
-            TextDraw('Fish in : ' + "PLA " + str(len(c.other_ponds["pla"].fishes)) + '  ',
-                     font, "black", SCREEN_WIDTH-350, 10).draw(screen)
-        if "sick-salmon" in c.other_ponds:
-            TextDraw('Fish in : ' + "SICK-SALMON " + str(len(c.other_ponds["sick-salmon"].fishes)) + '  ',
-                     font, "black", SCREEN_WIDTH-350, 30).draw(screen)
-        if "peem" in c.other_ponds:
-            TextDraw('Fish in : ' + "PEEM " + str(len(c.other_ponds["peem"].fishes)) + '  ',
-                     font, "black", SCREEN_WIDTH-350, 50).draw(screen)
-        if "dang" in c.other_ponds:
-            TextDraw('Fish in : ' + "DANG " + str(len(c.other_ponds["dang"].fishes)) + '  ',
-                     font, "black", SCREEN_WIDTH-350, 70).draw(screen)
-
-        # idx += 1
-
-        fish_list.draw(screen)
-        maxBar_list.draw(screen)
-        bar_list.draw(screen)
-
-        pygame.display.flip()
-        clock.tick(TPS)
+            fish.update(alpha)
+
+        for pond_name, label, line in hud:
+            pond = c.other_ponds.get(pond_name)
+            if pond is None:
+                line.setText(None)
+            else:
+                line.setText('Fish in : ' + label + " " + str(len(pond)) + '  ')
+
+        pygame.display.update(sprites.draw(screen))
+        clock.tick(MAX_FPS)
 
     # del font,
 
+    if recorder is not None:
+        recorder.close()
     pygame.display.quit()
     pygame.quit()
@@ -0,0 +1,44 @@
+import cProfile
+import pstats
+import sys
+import time
+
+from SessionLog import Replay
+
+# Re-runs a recorded pond session headless and checks that every tick
+# matches the live run bit for bit.
+#
+#   python main.py --seed 42 --record session.log
+#   python replay.py session.log [--profile]
+
+
+def main(path, profile=False):
+    replay = Replay(path)
+    header = replay.header
+    print(f"pond {header['pond']} engine {header['engine']} seed {header['seed']}: "
+          f"{replay.ticks} ticks, {len(replay.inputs)} with network input, "
+          f"{len(replay.checks)} checkpoints")
+    profiler = cProfile.Profile() if profile else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    ok = replay.run()
+    if profiler is not None:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+    print(f"replayed in {elapsed:.2f}s ({replay.ticks / max(elapsed, 1e-9):.0f} ticks/s), "
+          f"{len(replay.pond)} fish at the end")
+    if ok:
+        print("all checkpoints match")
+    else:
+        print(f"state differs from the recording at ticks {replay.mismatches[:10]}")
+    if profiler is not None:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    return ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python replay.py SESSION_LOG [--profile]")
+        sys.exit(2)
+    sys.exit(0 if main(sys.argv[1], "--profile" in sys.argv) else 1)
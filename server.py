@@ -1,3 +1,5 @@
+import asyncio
+import itertools
 import socket
 import threading
 import sys
@@ -5,8 +7,13 @@ import time
 # sys.path.append('../src')
 from FishData import FishData
 from PondData import PondData
+from PondSummary import PondSummary
 from Payload import Payload
-import pickle
+from MessageStream import MessageStream, AsyncMessageStream, FrameError
+import Compression
+from Outbox import Outbox
+from WireFormat import WireError
+import WireFormat
 from queue import Queue
 
 # IP = 'localhost'
@@ -16,51 +23,483 @@ ADDR = (IP, PORT)
 MSG_SIZE = 4096
 FORMAT = "utf-8"
 DISCONNECT_MSG = "!DISCONNECT"
+BOUNCE_MSG = "BOUNCE"
+HEARTBEAT_MSG = "HEARTBEAT"
+HELLO_MSG = "HELLO"
+ACK_MSG = "ACK"
+SUBSCRIBE_MSG = "SUBSCRIBE"
+SUMMARY_MSG = "SUMMARY"
+ASYNC_BACKLOG = 4096
+# Ponds send something at least every HEARTBEAT_INTERVAL seconds; one that
+# stays silent for MAX_MISSED_HEARTBEATS intervals is evicted
+HEARTBEAT_INTERVAL = 2
+MAX_MISSED_HEARTBEATS = 3
+# A MIGRATE forwarded to its destination waits this long for the pond's ACK;
+# after that its sender has given up anyway
+RELAY_TIMEOUT = 10
 
+# address -> PondConnection (threaded mode) or AsyncPondConnection (asyncio mode)
 all_connections = {}
+# pondName -> address, learned from the ponds' own SEND/DELTA messages
+pond_addresses = {}
+address_ponds = {}
+connections_lock = threading.Lock()
+# pondName -> (version, fish count), from the SEND/DELTA messages we relay;
+# what ponds subscribed at COUNT detail are sent instead of the messages
+pond_counts = {}
+# Set by shardserver.py when this process is one shard of a sharded hub
+shard_bus = None
+# MIGRATEs forwarded under an id of ours, waiting for the destination's ACK:
+# relay id -> (reply, deadline); reply() passes the ACK on to the sender
+relays = {}
+relay_ids = itertools.count(1)
+relays_lock = threading.Lock()
 
 payload = Payload()  # Initialize payload
 
 
+def register_pond(address, connection):
+    with connections_lock:
+        all_connections[address] = connection
+
+
+def unregister_pond(address):
+    with connections_lock:
+        pondName = address_ponds.pop(address, None)
+        if pond_addresses.get(pondName) == address:
+            del pond_addresses[pondName]
+        return all_connections.pop(address, None)
+
+
+def learn_pond_name(address, pondName):
+    with connections_lock:
+        if address_ponds.get(address) == pondName:
+            return
+        old = address_ponds.get(address)
+        if old is not None and pond_addresses.get(old) == address:
+            del pond_addresses[old]
+        address_ponds[address] = pondName
+        pond_addresses[pondName] = address
+
+
+def find_pond(pondName):
+    with connections_lock:
+        address = pond_addresses.get(pondName)
+        return address, all_connections.get(address)
+
+
+def current_connections():
+    with connections_lock:
+        return list(all_connections.items())
+
+
+def drop_pond(address):
+    # Forget a pond that left without a !DISCONNECT and tell everyone else
+    with connections_lock:
+        pondName = address_ponds.get(address)
+    connection = unregister_pond(address)
+    if connection is None:
+        return
+    connection.close()
+    if pondName is None or find_pond(pondName)[1] is not None:
+        # Never named itself, or it already reconnected on a new socket
+        return
+    data = announce_gone(pondName)
+    if shard_bus is not None:
+        shard_bus.publish(data, DISCONNECT_MSG)
+
+
+def announce_gone(pondName):
+    # Tell our ponds that pondName left, as its own !DISCONNECT would have.
+    # Returns the encoded message.
+    temp = Payload()
+    temp.action = DISCONNECT_MSG
+    temp.data = PondData(pondName)
+    track_pond(temp)
+    data = WireFormat.encode(temp)
+    broadcast(data, DISCONNECT_MSG)
+    return data
+
+
+def reap_silent_ponds():
+    limit = HEARTBEAT_INTERVAL * MAX_MISSED_HEARTBEATS
+    now = time.monotonic()
+    for addr, conn in current_connections():
+        if now - conn.last_seen > limit:
+            print(f"Pond {addr} missed {MAX_MISSED_HEARTBEATS} heartbeats, evicting")
+            drop_pond(addr)
+
+
+def expire_relays():
+    now = time.monotonic()
+    with relays_lock:
+        for relayId, (reply, deadline) in list(relays.items()):
+            if deadline <= now:
+                del relays[relayId]
+
+
+def reap_loop():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        reap_silent_ponds()
+        expire_relays()
+
+
+async def reap_loop_async():
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        reap_silent_ponds()
+        expire_relays()
+
+
+class PondConnection:
+    # One pond on the threaded server: the reader runs in handle_pond, and a
+    # writer thread drains the outbox so a slow pond only delays itself.
+    def __init__(self, stream, address):
+        self.stream = stream
+        self.address = address
+        self.ready = threading.Event()
+        self.outbox = Outbox(on_ready=self.ready.set)
+        self.closed = False
+        self.last_seen = time.monotonic()
+        # pondName -> detail once the pond has sent SUBSCRIBE; until then it
+        # gets every pond in full
+        self.subscriptions = None
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def enqueue(self, frame, action, pondName=None):
+        self.outbox.put(frame, action, pondName)
+
+    def write_loop(self):
+        # Flushes whatever is queued before exiting, so a pond still gets
+        # the last messages sent to it before close()
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            frames = self.outbox.pop_all()
+            try:
+                if frames:
+                    self.stream.write_raw(b"".join(frames))
+            except OSError as e:
+                print(f"Could not reach pond {self.address}: {e}")
+                drop_pond(self.address)
+                self.closed = True
+            if self.closed:
+                break
+        self.stream.close()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+
+class AsyncPondConnection:
+    # Same as PondConnection, with the writer as a task on the event loop
+    def __init__(self, stream, address):
+        self.stream = stream
+        self.address = address
+        self.ready = asyncio.Event()
+        self.outbox = Outbox(on_ready=self.ready.set)
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self.subscriptions = None
+        self.writer = asyncio.ensure_future(self.write_loop())
+
+    def enqueue(self, frame, action, pondName=None):
+        self.outbox.put(frame, action, pondName)
+
+    async def write_loop(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            frames = self.outbox.pop_all()
+            try:
+                if frames:
+                    self.stream.write_raw(b"".join(frames))
+                    await self.stream.drain()
+            except (ConnectionError, OSError) as e:
+                print(f"Could not reach pond {self.address}: {e}")
+                drop_pond(self.address)
+                self.closed = True
+            if self.closed:
+                break
+        self.stream.close()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+
+def dispatch(address, msg, data):
+    # Shared by both server modes. data is the message exactly as it came
+    # off the wire, so forwarding it never re-encodes anything.
+    # Returns False once the pond has left.
+    if msg.action == DISCONNECT_MSG:
+        # Queued before the connection closes, and the writer flushes it
+        acknowledge(address, msg)
+        track_pond(msg)
+        unregister_pond(address)
+        print("-------------------------", msg.action)
+        broadcast(data, DISCONNECT_MSG)
+        if shard_bus is not None:
+            shard_bus.publish(data, DISCONNECT_MSG)
+        return False
+
+    if msg.action == "MIGRATE":
+        route_migration(address, msg, data)
+        return True
+
+    if msg.action == ACK_MSG:
+        # A pond confirming a MIGRATE we forwarded to it
+        relay_ack(msg.id)
+        return True
+
+    if msg.action == HELLO_MSG:
+        negotiate_codec(address, msg.data)
+        return True
+
+    if msg.action == SUBSCRIBE_MSG:
+        subscribe(address, msg)
+        return True
+
+    if msg.action == HEARTBEAT_MSG:
+        # Echo it so the pond knows the hub is alive too
+        if msg.data is not None:
+            learn_pond_name(address, msg.data.pondName)
+        with connections_lock:
+            sender = all_connections.get(address)
+        if sender is not None:
+            sender.enqueue(sender.stream.frame(data), HEARTBEAT_MSG)
+        return True
+
+    pondName = None
+    summary = None
+    if msg.action in ("SEND", "DELTA"):
+        pondName = msg.data.pondName
+        learn_pond_name(address, pondName)
+        summary = track_pond(msg)
+    broadcast(data, msg.action, pondName, summary)
+    if shard_bus is not None:
+        shard_bus.publish(data, msg.action, pondName)
+    return True
+
+
+def negotiate_codec(address, offered):
+    # Reply with the codec we picked (or none), then start using it. The reply
+    # itself is framed before the switch, so the pond can always read it.
+    with connections_lock:
+        sender = all_connections.get(address)
+    if sender is None:
+        return
+    chosen = Compression.choose(offered)
+    reply = Payload()
+    reply.action = HELLO_MSG
+    reply.data = [chosen] if chosen is not None else []
+    sender.enqueue(sender.stream.frame(WireFormat.encode(reply)), HELLO_MSG)
+    sender.stream.codec = Compression.codec_id(chosen)
+
+
+def track_pond(msg):
+    # Keeps pond_counts up to date with a SEND/DELTA/!DISCONNECT. Returns an
+    # encoded SUMMARY when the pond's fish count changed, else None.
+    if msg.action == DISCONNECT_MSG:
+        if msg.data is not None:
+            pond_counts.pop(msg.data.pondName, None)
+        return None
+    data = msg.data
+    old = pond_counts.get(data.pondName)
+    if msg.action == "SEND":
+        count = len(data)
+    elif old is not None and old[0] == data.baseVersion:
+        count = old[1] + len(data.added) - len(data.removed)
+    else:
+        # A delta we can not place; the next keyframe fixes the count
+        return None
+    pond_counts[data.pondName] = (data.version, count)
+    if old is not None and old[1] == count:
+        return None
+    return encode_summary(data.pondName, data.version, count)
+
+
+def encode_summary(pondName, version, count):
+    summary = Payload()
+    summary.action = SUMMARY_MSG
+    summary.data = PondSummary(pondName, version, count)
+    return WireFormat.encode(summary)
+
+
+def subscribe(address, msg):
+    # Replaces the pond's subscriptions, then sends it the counts we already
+    # know for the ponds it wants at COUNT detail
+    with connections_lock:
+        sender = all_connections.get(address)
+    if sender is None:
+        return
+    sender.subscriptions = msg.data
+    acknowledge(address, msg)
+    for pondName, detail in msg.data.items():
+        known = pond_counts.get(pondName)
+        if detail == "COUNT" and known is not None:
+            data = encode_summary(pondName, *known)
+            sender.enqueue(sender.stream.frame(data), SUMMARY_MSG, pondName)
+
+
+def broadcast(data, action, pondName=None, summary=None):
+    # One frame per codec in use, shared by every pond that uses that codec.
+    # Ponds that subscribed only get SEND/DELTA of the ponds they asked for,
+    # and for the ones they asked to count only, the SUMMARY (if any)
+    # instead of the message.
+    frames = {}
+    summaries = {}
+    for addr, conn in current_connections():
+        codec = conn.stream.codec
+        subscriptions = conn.subscriptions
+        if pondName is not None and subscriptions is not None:
+            detail = subscriptions.get(pondName)
+            if detail is None:
+                continue
+            if detail == "COUNT":
+                if summary is not None:
+                    frame = summaries.get(codec)
+                    if frame is None:
+                        frame = summaries[codec] = conn.stream.frame(summary)
+                    conn.enqueue(frame, SUMMARY_MSG, pondName)
+                continue
+        frame = frames.get(codec)
+        if frame is None:
+            frame = frames[codec] = conn.stream.frame(data)
+        conn.enqueue(frame, action, pondName)
+
+
+def route_migration(address, msg, data):
+    # Unicast to the destination pond; unknown destinations go back to sender.
+    # The sender's ACK comes from the destination pond once it has the fish.
+    destination = msg.data["destination"]
+    addr, conn = find_pond(destination)
+    if conn is not None:
+        forward_migration(conn, msg, data, lambda: acknowledge(address, msg))
+        return
+    # The shard that owns the destination acknowledges or bounces it
+    if shard_bus is not None and shard_bus.route_migration(address, destination, data):
+        return
+    bounce_migration(address, msg)
+
+
+def forward_migration(conn, msg, data, reply):
+    # Hands the MIGRATE to the destination pond. If its sender is waiting for
+    # an answer, the pond gets it under a relay id of ours, and its ACK for
+    # that id calls reply().
+    if msg.id:
+        with relays_lock:
+            relayId = next(relay_ids) % 0x100000000 or next(relay_ids)
+            relays[relayId] = (reply, time.monotonic() + RELAY_TIMEOUT)
+        data = WireFormat.with_id(data, relayId)
+    conn.enqueue(conn.stream.frame(data), "MIGRATE")
+
+
+def relay_ack(relayId):
+    with relays_lock:
+        entry = relays.pop(relayId, None)
+    if entry is not None:
+        entry[0]()
+
+
+def bounce_migration(address, msg):
+    # The BOUNCE answers the MIGRATE, so it carries the same correlation id
+    print(f"No pond named {msg.data['destination']!r}, bouncing migration back to {address}")
+    bounce = Payload()
+    bounce.action = BOUNCE_MSG
+    bounce.id = msg.id
+    bounce.data = msg.data
+    with connections_lock:
+        sender = all_connections.get(address)
+    if sender is not None:
+        sender.enqueue(sender.stream.frame(WireFormat.encode(bounce)), BOUNCE_MSG)
+
+
+def acknowledge(address, msg):
+    # Tell the sender its request went through, if it is waiting to hear
+    if not msg.id:
+        return
+    with connections_lock:
+        sender = all_connections.get(address)
+    if sender is None:
+        return
+    ack = Payload()
+    ack.action = ACK_MSG
+    ack.id = msg.id
+    sender.enqueue(sender.stream.frame(WireFormat.encode(ack)), ACK_MSG)
+
+
 def handle_pond(connection, address):
     print(f"New pond connected from : {address}")
 
+    stream = connection.stream
     connected = True
     while connected:
-        message = connection.recv(MSG_SIZE)
+        try:
+            data = stream.read_frame()
+            msg = WireFormat.decode(data) if data is not None else None
+        except (OSError, FrameError, WireError) as e:
+            print(f"Pond {address} dropped: {e}")
+            msg = None
+        if msg is None:
+            # Pond closed its socket without saying goodbye
+            drop_pond(address)
+            break
+        connection.last_seen = time.monotonic()
         # separate message type
 
-        msg = pickle.loads(message)
         # print(f"{address} : {msg}")
         # print(all_connections)
-        if msg.action == DISCONNECT_MSG:
-            connected = False
-            all_connections.pop(address)
-            for addr, conn in all_connections.items():
-                # conn.send(f"{address} disconnected.".encode(FORMAT))
-                print("-------------------------", msg.action)
-                print(msg.data)
-                temp = Payload()
-                temp.action = DISCONNECT_MSG
-                temp.data = msg.data
-                conn.send(pickle.dumps(temp))
+        connected = dispatch(address, msg, data)
 
-        else:
-            for addr, conn in all_connections.items():
-                print(msg)
-                print("The Pond has sent")
+    connection.close()
+    connection.writer.join()
 
-                conn.send(pickle.dumps(msg))
 
-    connection.close()
+async def handle_pond_async(reader, writer):
+    address = writer.get_extra_info("peername")
+    stream = AsyncMessageStream(reader, writer)
+    connection = AsyncPondConnection(stream, address)
+    register_pond(address, connection)
+    print(f"New pond connected from : {address}")
 
+    try:
+        connected = True
+        while connected:
+            data = await stream.read_frame()
+            if data is None:
+                drop_pond(address)
+                break
+            connection.last_seen = time.monotonic()
+            connected = dispatch(address, WireFormat.decode(data), data)
+    except (ConnectionError, FrameError, WireError) as e:
+        print(f"Pond {address} dropped: {e}")
+        drop_pond(address)
+    finally:
+        # The writer flushes what is already queued, then closes the socket
+        connection.close()
+        await connection.writer
 
-if __name__ == "__main__":
-    print("Starting vivisystem...")
+
+async def serve_async(addr=ADDR):
+    server = await asyncio.start_server(
+        handle_pond_async, addr[0], addr[1], backlog=ASYNC_BACKLOG)
+    print(f"Vivisystem (asyncio) is listening on {addr[0]}:{addr[1]}")
+    asyncio.ensure_future(reap_loop_async())
+    async with server:
+        await server.serve_forever()
+
+
+def serve_threaded(addr=ADDR):
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(ADDR)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(addr)
     server.listen(100)
-    print(f"Vivisystem is listening on {IP}:{PORT}")
+    print(f"Vivisystem is listening on {addr[0]}:{addr[1]}")
+    threading.Thread(target=reap_loop, daemon=True).start()
 
     while True:
         add, con = server.accept()
@@ -71,10 +510,31 @@ if __name__ == "__main__":
             clientAddress = con
             clientConnection = add
 
-        all_connections[clientAddress] = clientConnection
+        clientConnection = PondConnection(
+            MessageStream(clientConnection), clientAddress)
+        register_pond(clientAddress, clientConnection)
 
         pond_handler = threading.Thread(
             target=handle_pond, args=(clientConnection, clientAddress,))
         pond_handler.start()
         print(
-            f"Ponds in the vivisystem: {threading.activeCount() - 1} {clientConnection} {clientAddress}")
+            f"Ponds in the vivisystem: {threading.active_count() - 1} {clientConnection} {clientAddress}")
+
+
+if __name__ == "__main__":
+    print("Starting vivisystem...")
+    if "--max-missed" in sys.argv:
+        MAX_MISSED_HEARTBEATS = int(sys.argv[sys.argv.index("--max-missed") + 1])
+    addr = ADDR
+    if "--port" in sys.argv:
+        addr = (IP, int(sys.argv[sys.argv.index("--port") + 1]))
+    # python server.py --asyncio  runs every pond on one event loop
+    if "--asyncio" in sys.argv:
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass
+        asyncio.run(serve_async(addr))
+    else:
+        serve_threaded(addr)
@@ -0,0 +1,299 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+import struct
+import sys
+import tempfile
+
+import server
+import ShardRing
+import WireFormat
+from MessageStream import AsyncMessageStream, FrameError
+from Payload import Payload
+from WireFormat import WireError
+
+# Sharded vivisystem: several hub processes, each running the asyncio server
+# for its own ponds, joined by a bus of Unix sockets.
+#
+#   python shardserver.py --shards 4              ponds pick a port with shard_address()
+#   python shardserver.py --shards 4 --reuseport  every shard listens on PORT
+#
+# Shard i serves PORT + i (or PORT for everyone with SO_REUSEPORT). Every
+# SEND/DELTA/!DISCONNECT is forwarded once to each other shard, which fans it
+# out to its own ponds and remembers which shard the sender lives on. A
+# MIGRATE for a pond on another shard goes straight to that shard; if the pond
+# is gone by the time it arrives, it comes back as a BOUNCE to the pond that
+# sent it, same as on a single hub. Otherwise, once the destination pond has
+# ACKed it, the destination shard sends a BUS_ACK back, and the sender's shard
+# turns it into the pond's ACK.
+
+SHARDS = 4
+BUS_RETRY_DELAY = 0.2
+BUS_CONNECT_TIMEOUT = 10
+BUS_MAX_RETRY_DELAY = 2
+
+BUS_STATE = 1
+BUS_MIGRATE = 2
+BUS_BOUNCE = 3
+BUS_ACK = 4
+# First frame on every bus link, so the receiving shard knows who is on the
+# other end (and notices when it goes away) before any traffic flows
+BUS_HELLO = 5
+
+# kind, sending shard, length of the origin tag that follows
+BUS_HEADER = struct.Struct("!BHH")
+
+
+def shard_address(pondName, addr=server.ADDR, shards=SHARDS):
+    # Where a pond should connect when the hub is sharded by port
+    return ShardRing.shard_address(pondName, addr, shards)
+
+
+def bus_path(port, shard):
+    return os.path.join(tempfile.gettempdir(), f"vivisystem-{port}-{shard}.sock")
+
+
+def origin_tag(address):
+    return f"{address[0]}:{address[1]}".encode("utf-8")
+
+
+def parse_origin(tag):
+    host, port = tag.decode("utf-8").rsplit(":", 1)
+    return (host, int(port))
+
+
+class ShardBus:
+    def __init__(self, index, shards, port):
+        self.index = index
+        self.shards = shards
+        self.port = port
+        # shard index -> AsyncPondConnection to that shard's bus socket
+        self.peers = {}
+        # shards whose bus link is down and being reopened
+        self.reconnecting = set()
+        # pondName -> shard index, learned from forwarded SEND/DELTA
+        self.remote_ponds = {}
+        self.closing = False
+
+    async def start(self):
+        path = bus_path(self.port, self.index)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.listener = await asyncio.start_unix_server(self.handle_peer, path)
+        for shard in range(self.shards):
+            if shard != self.index:
+                await self.connect_peer(shard)
+        print(f"Shard {self.index}: bus connected to {len(self.peers)} shards")
+
+    async def connect_peer(self, shard):
+        deadline = asyncio.get_running_loop().time() + BUS_CONNECT_TIMEOUT
+        while True:
+            try:
+                await self.open_peer(shard)
+                return
+            except OSError:
+                if asyncio.get_running_loop().time() > deadline:
+                    raise
+                await asyncio.sleep(BUS_RETRY_DELAY)
+
+    async def open_peer(self, shard):
+        reader, writer = await asyncio.open_unix_connection(bus_path(self.port, shard))
+        self.peers[shard] = server.AsyncPondConnection(
+            AsyncMessageStream(reader, writer), ("shard", shard))
+        self.send_to_shard(shard, BUS_HELLO, b"", "HELLO")
+
+    def close(self):
+        self.closing = True
+        self.listener.close()
+        for peer in self.peers.values():
+            peer.close()
+
+    def peer_lost(self, shard):
+        # Drop the link to shard and keep trying to reopen it, so a shard
+        # that restarts rejoins the bus
+        peer = self.peers.pop(shard, None)
+        if peer is not None:
+            peer.close()
+        if self.closing:
+            return
+        self.forget_shard(shard)
+        if shard not in self.reconnecting:
+            self.reconnecting.add(shard)
+            asyncio.ensure_future(self.reconnect_peer(shard))
+
+    async def reconnect_peer(self, shard):
+        delay = BUS_RETRY_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.open_peer(shard)
+                break
+            except OSError:
+                delay = min(delay * 2, BUS_MAX_RETRY_DELAY)
+        self.reconnecting.discard(shard)
+        print(f"Shard {self.index}: bus reconnected to shard {shard}")
+
+    def send_to_shard(self, shard, kind, data, action, pondName=None, origin=b""):
+        peer = self.peers.get(shard)
+        if peer is None:
+            return False
+        if peer.closed:
+            # Its writer failed; nothing queued on it would ever be written
+            self.peer_lost(shard)
+            return False
+        body = BUS_HEADER.pack(kind, self.index, len(origin)) + origin + data
+        peer.enqueue(peer.stream.frame(body), action, pondName)
+        return True
+
+    def publish(self, data, action, pondName=None):
+        for shard in list(self.peers):
+            self.send_to_shard(shard, BUS_STATE, data, action, pondName)
+
+    def route_migration(self, address, destination, data):
+        shard = self.remote_ponds.get(destination)
+        if shard is None:
+            return False
+        return self.send_to_shard(shard, BUS_MIGRATE, data, "MIGRATE",
+                                  origin=origin_tag(address))
+
+    async def handle_peer(self, reader, writer):
+        stream = AsyncMessageStream(reader, writer)
+        sender = None
+        try:
+            while True:
+                body = await stream.read_frame()
+                if body is None:
+                    break
+                kind, sender, tagLength = BUS_HEADER.unpack_from(body)
+                start = BUS_HEADER.size
+                origin = body[start:start + tagLength]
+                data = body[start + tagLength:]
+                self.handle_bus_message(kind, sender, origin, data)
+        except (ConnectionError, FrameError, WireError, struct.error) as e:
+            print(f"Shard {self.index}: bus link from shard {sender} failed: {e}")
+        except asyncio.CancelledError:
+            # This shard is shutting down
+            pass
+        finally:
+            stream.close()
+            if sender is not None:
+                # The shard went away; our own link to it is as good as dead
+                self.peer_lost(sender)
+
+    def handle_bus_message(self, kind, sender, origin, data):
+        if kind == BUS_HELLO:
+            return
+        msg = WireFormat.decode(data)
+        if kind == BUS_STATE:
+            pondName = None
+            summary = None
+            if msg.action in ("SEND", "DELTA"):
+                pondName = msg.data.pondName
+                self.remote_ponds[pondName] = sender
+                summary = server.track_pond(msg)
+            elif msg.action == server.DISCONNECT_MSG and msg.data is not None:
+                if self.remote_ponds.get(msg.data.pondName) == sender:
+                    del self.remote_ponds[msg.data.pondName]
+                    server.track_pond(msg)
+            server.broadcast(data, msg.action, pondName, summary)
+
+        elif kind == BUS_MIGRATE:
+            addr, conn = server.find_pond(msg.data["destination"])
+            if conn is not None:
+                server.forward_migration(
+                    conn, msg, data,
+                    lambda: self.acknowledge(sender, origin, msg.id))
+            else:
+                self.send_to_shard(sender, BUS_BOUNCE, data, "MIGRATE",
+                                   origin=origin)
+
+        elif kind == BUS_BOUNCE:
+            server.bounce_migration(parse_origin(origin), msg)
+
+        elif kind == BUS_ACK:
+            server.acknowledge(parse_origin(origin), msg)
+
+    def acknowledge(self, shard, origin, requestId):
+        # The destination pond has the fish; tell the sender, on shard
+        ack = Payload()
+        ack.action = server.ACK_MSG
+        ack.id = requestId
+        self.send_to_shard(shard, BUS_ACK, WireFormat.encode(ack),
+                           server.ACK_MSG, origin=origin)
+
+    def forget_shard(self, shard):
+        # Its ponds are gone with it, as far as our ponds can tell
+        for pondName, owner in list(self.remote_ponds.items()):
+            if owner == shard:
+                del self.remote_ponds[pondName]
+                if server.find_pond(pondName)[1] is None:
+                    server.announce_gone(pondName)
+
+
+async def run_shard(index, shards, addr, reuseport):
+    bus = ShardBus(index, shards, addr[1])
+    server.shard_bus = bus
+    port = addr[1] if reuseport else addr[1] + index
+    hub = await asyncio.start_server(
+        server.handle_pond_async, addr[0], port,
+        backlog=server.ASYNC_BACKLOG, reuse_port=reuseport or None)
+    await bus.start()
+    print(f"Shard {index} is listening on {addr[0]}:{port}")
+    asyncio.ensure_future(server.reap_loop_async())
+    stopped = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    async with hub:
+        await stopped.wait()
+    bus.close()
+
+
+def shard_main(index, shards, addr, reuseport):
+    # Ends on SIGTERM (see run_shard) or Ctrl-C
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    try:
+        asyncio.run(run_shard(index, shards, addr, reuseport))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        path = bus_path(addr[1], index)
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def serve_sharded(addr=server.ADDR, shards=SHARDS, reuseport=False):
+    # The shards go down with us, whether we are interrupted or terminated
+    processes = [multiprocessing.Process(target=shard_main,
+                                         args=(i, shards, addr, reuseport),
+                                         daemon=True)
+                 for i in range(shards)]
+    # SIGTERM becomes SystemExit, so the finally below still runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            if process.pid is not None:
+                process.join()
+
+
+if __name__ == "__main__":
+    print("Starting sharded vivisystem...")
+    shards = SHARDS
+    if "--shards" in sys.argv:
+        shards = int(sys.argv[sys.argv.index("--shards") + 1])
+    if "--max-missed" in sys.argv:
+        server.MAX_MISSED_HEARTBEATS = int(sys.argv[sys.argv.index("--max-missed") + 1])
+    serve_sharded(shards=shards, reuseport="--reuseport" in sys.argv)